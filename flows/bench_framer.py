@@ -0,0 +1,109 @@
+#!/usr/bin/env python3.5
+#
+# ---------------------------------------------------------------
+# * Copyright (c) 2018
+# * Broadcom Corporation
+# * All Rights Reserved.
+# *---------------------------------------------------------------
+# Redistribution and use in source and binary forms, with or without modification, are permitted
+# provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this list of conditions
+# and the following disclaimer.  Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the documentation and/or other
+# materials provided with the distribution.  Neither the name of the Broadcom nor the names of
+# contributors may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Author Robert J. McMahon, Broadcom LTD
+#
+# Micro-benchmark for the iperf pipe line framing, reports lines/sec on
+# synthetic enhanced (-e) iperf client output
+#
+# Date October 2026
+import argparse
+import random
+import time
+
+from flows import line_framer, iperf_client_classifier
+
+parser = argparse.ArgumentParser(description='Benchmark line framing of iperf pipe output')
+parser.add_argument('-n','--lines', type=int, default=200000, required=False, help='number of synthetic iperf lines')
+parser.add_argument('-f','--flows', type=int, default=50, required=False, help='number of flows interleaved into the output')
+parser.add_argument('-c','--chunk', type=int, default=65536, required=False, help='maximum pipe read size in bytes')
+parser.add_argument('-r','--repeat', type=int, default=3, required=False, help='repetitions, best time is reported')
+args = parser.parse_args()
+
+def synthetic_output(count, flows) :
+    # [  3] 0.00-0.50 sec  655620 Bytes  10489920 bits/sec  14/211        446      446K/0 us
+    lines = ['Client connecting to 192.168.1.1, TCP port 61001 with pid 1903\n']
+    for i in range(count) :
+        start = (i // flows) * 0.005
+        lines.append('[{:3d}] {:.2f}-{:.2f} sec  {} Bytes  {} bits/sec  {}/0        0      {}K/{} us\n'.format(3 + (i % flows), start, start + 0.005, random.randint(1000, 700000), random.randint(10**6, 10**9), random.randint(1, 500), random.randint(10, 4000), random.randint(100, 9000)))
+    return ''.join(lines).encode()
+
+def chunked(data, size) :
+    chunks = []
+    ix = 0
+    while ix < len(data) :
+        n = random.randint(1, size)
+        chunks.append(data[ix:ix + n])
+        ix += n
+    return chunks
+
+def str_split(chunks) :
+    # The original parse loop, decode every chunk then split the str buffer
+    count = 0
+    buffer = ""
+    for data in chunks :
+        buffer += data.decode("utf-8")
+        while "\n" in buffer :
+            line, buffer = buffer.split("\n", 1)
+            count += 1
+    return count
+
+def framed(chunks) :
+    count = 0
+    framer = line_framer()
+    for data in chunks :
+        for line in framer.feed(data) :
+            count += 1
+    return count
+
+def classified(chunks) :
+    count = 0
+    framer = line_framer()
+    classify = iperf_client_classifier.classify
+    for data in chunks :
+        for line in framer.feed(data) :
+            kind, m = classify(line)
+            if kind :
+                count += 1
+    return count
+
+def best_of(func, chunks) :
+    best = None
+    for i in range(args.repeat) :
+        start = time.perf_counter()
+        count = func(chunks)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best :
+            best = elapsed
+    return count, best
+
+data = synthetic_output(args.lines, args.flows)
+chunks = chunked(data, args.chunk)
+print('{} lines, {} bytes in {} chunks (max {} bytes)'.format(args.lines + 1, len(data), len(chunks), args.chunk))
+for name, func in [('str split', str_split), ('line_framer', framed), ('classified', classified)] :
+    count, elapsed = best_of(func, chunks)
+    print('{:12s} {:8d} lines {:8.3f} sec {:12.0f} lines/sec'.format(name, count, elapsed, count / elapsed))
+print('classifier hits {}'.format(dict(iperf_client_classifier.hits)))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3.5
+#
+# ---------------------------------------------------------------
+# * Copyright (c) 2018
+# * Broadcom Corporation
+# * All Rights Reserved.
+# *---------------------------------------------------------------
+# Redistribution and use in source and binary forms, with or without modification, are permitted
+# provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this list of conditions
+# and the following disclaimer.  Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the documentation and/or other
+# materials provided with the distribution.  Neither the name of the Broadcom nor the names of
+# contributors may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Author Robert J. McMahon, Broadcom LTD
+#
+# Startup benchmark, times 'import flows' in fresh interpreters and appends the
+# result to a history file so import time can be tracked over time
+#
+# Date October 2026
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+parser = argparse.ArgumentParser(description='Benchmark the import time of the flows module')
+parser.add_argument('-r','--repeat', type=int, default=10, required=False, help='number of fresh interpreter imports')
+parser.add_argument('--history', type=str, default='bench_import.history', required=False, help='history file (JSON lines) the result is appended to')
+parser.add_argument('--threshold', type=float, default=20.0, required=False, help='warn when the median is this percent slower than the last run')
+args = parser.parse_args()
+
+# the import under test, also reports which heavy modules it pulled in
+probe = "import sys, time; start = time.perf_counter(); import flows; elapsed = time.perf_counter() - start; print(elapsed, ','.join([m for m in ['scipy', 'matplotlib', 'tkinter'] if m in sys.modules]))"
+
+directory = os.path.dirname(os.path.abspath(__file__))
+samples = []
+loaded = ''
+for i in range(args.repeat) :
+    output = subprocess.check_output([sys.executable, '-c', probe], cwd=directory).decode().split()
+    samples.append(float(output[0]))
+    loaded = output[1] if len(output) > 1 else ''
+
+result = {'date' : time.strftime('%Y-%m-%d %H:%M:%S'), 'host' : platform.node(), 'machine' : platform.machine(), 'python' : platform.python_version(), 'repeat' : args.repeat, 'min' : min(samples), 'median' : statistics.median(samples), 'loaded' : loaded}
+try :
+    revision = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=directory, stderr=subprocess.DEVNULL).decode().strip()
+    result['revision'] = revision
+except (OSError, subprocess.CalledProcessError) :
+    pass
+
+previous = None
+if os.path.exists(args.history) :
+    with open(args.history, 'r') as fid :
+        for line in fid :
+            if line.strip() :
+                entry = json.loads(line)
+                if entry.get('host') == result['host'] and entry.get('python') == result['python'] :
+                    previous = entry
+
+print('import flows: min {:.3f} sec median {:.3f} sec over {} runs, heavy modules loaded: {}'.format(result['min'], result['median'], args.repeat, loaded or 'none'))
+if previous :
+    change = (result['median'] - previous['median']) / previous['median'] * 100
+    print('previous ({} {}): median {:.3f} sec, change {:+.1f}%'.format(previous['date'], previous.get('revision', ''), previous['median'], change))
+    if change > args.threshold :
+        print('WARNING: import time regressed by more than {}%'.format(args.threshold))
+
+with open(args.history, 'a') as fid :
+    fid.write(json.dumps(result) + '\n')
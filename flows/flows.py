@@ -36,23 +36,490 @@ import weakref
 import os
 import getpass
 import math
-import scipy
-import scipy.spatial
 import numpy as np
-import tkinter
 import ctypes
 import ipaddress
 import collections
+import itertools
+import array
+import mmap
+import concurrent.futures
+import hashlib
+import shutil
+import io
+import threading
+import functools
+import atexit
 
 from datetime import datetime as datetime, timezone
-from scipy import stats
-from scipy.cluster import hierarchy
-from scipy.cluster.hierarchy import linkage
-import matplotlib.pyplot as plt
 from collections import defaultdict
 
 logger = logging.getLogger(__name__)
 
+try :
+    monotonic_ns = time.monotonic_ns
+except AttributeError :
+    def monotonic_ns() :
+        return int(time.monotonic() * 1e9)
+
+# scipy and matplotlib are only needed for the KS, clustering and plotting so they
+# are imported on first use, which keeps 'import flows' quick for traffic only
+# scripts.  matplotlib gets the non-interactive Agg backend (no GUI toolkit)
+# unless pyplot was already loaded by the caller.
+def pyplot() :
+    if 'matplotlib.pyplot' not in sys.modules :
+        import matplotlib
+        matplotlib.use('Agg')
+    import matplotlib.pyplot
+    return matplotlib.pyplot
+
+def ks_2samp_binned(x1, c1, x2, c2) :
+    # Two sample KS of two histograms, x are the bin values (us) and c their counts,
+    # see flow_histogram.ks_2samp()
+    import scipy.special
+    support = np.union1d(x1, x2)
+    cdf1 = np.cumsum(np.bincount(np.searchsorted(support, x1), weights=c1, minlength=len(support)))
+    cdf2 = np.cumsum(np.bincount(np.searchsorted(support, x2), weights=c2, minlength=len(support)))
+    n1 = cdf1[-1]
+    n2 = cdf2[-1]
+    d = float(np.max(np.abs(cdf1 / n1 - cdf2 / n2)))
+    en = math.sqrt(n1 * n2 / (n1 + n2))
+    # kolmogorov() is the survival function of stats.kstwobign without the rv_continuous overhead
+    p = float(min(1.0, scipy.special.kolmogorov((en + 0.12 + 0.11 / en) * d)))
+    return d, p
+
+def ks_pairs(grids, pairs) :
+    # Process pool worker for the KS tables, grids are the (x, c) bins of each
+    # histogram and pairs the (row, column) indices to compare
+    return [ks_2samp_binned(*(grids[i] + grids[j])) for i, j in pairs]
+
+class line_framer(object):
+    # Incremental newline framing of raw pipe bytes.  Complete lines are handed
+    # out as memoryview slices of the receive buffer and nothing is decoded, so
+    # only the lines a parser actually cares about pay for str conversion.  A read
+    # offset walks the buffer and only the trailing partial line is carried into
+    # the next chunk, i.e. a burst costs O(n) rather than the O(n^2) of repeatedly
+    # splitting a str buffer.
+    def __init__(self, eol=b'\n') :
+        self.eol = eol
+        self.lines = 0
+        self.bytes = 0
+        self._buffer = bytearray()
+        self._offset = 0
+
+    def feed(self, data) :
+        if self._offset :
+            # Keep only the partial line.  Copy into a new bytearray (rather than
+            # deleting in place) as callers may still hold views of the old one.
+            self._buffer = self._buffer[self._offset:]
+            self._offset = 0
+        try :
+            self._buffer.extend(data)
+        except BufferError :
+            self._buffer = self._buffer + data
+        self.bytes += len(data)
+        return self._frames()
+
+    def flush(self) :
+        # Hand out a trailing line that has no terminator, e.g. at EOF
+        if self._offset < len(self._buffer) :
+            line = memoryview(self._buffer)[self._offset:]
+            self._offset = len(self._buffer)
+            self.lines += 1
+            yield line
+
+    @property
+    def pending(self) :
+        return len(self._buffer) - self._offset
+
+    def _frames(self) :
+        buffer = self._buffer
+        view = memoryview(buffer)
+        eol = self.eol
+        start = self._offset
+        end = buffer.find(eol, start)
+        while end >= 0 :
+            # advance before yielding so a consumer that stops early resumes correctly
+            self._offset = end + 1
+            self.lines += 1
+            yield view[start:end]
+            start = end + 1
+            end = buffer.find(eol, start)
+
+class iperf_line_classifier(object):
+    # Single pass classification of iperf output lines.  A line is dispatched on
+    # its prefix or marker first, then exactly one extraction pattern is run
+    # against it.  Patterns are compiled once per class (not per flow) and a hit
+    # count is kept per pattern, see report()
+    OPEN = 'open'
+    LOCAL = 'local'
+    TRAFFIC = 'traffic'
+    TRIP_TIME = 'trip_time'
+    HISTOGRAM = 'histogram'
+    SUM = 'sum'
+
+    # ex. [  3] local ..., [  3] 0.00-0.50 sec ..., [  3] 0.0000-0.5259 trip-time ...
+    regex_dispatch = re.compile(rb'\[\s*(?:\d+|SUM)\] (?:(?P<local>local )|\S+ (?:(?P<sec>sec )|(?P<trip>trip-time )))')
+    open_prefix = b''
+    patterns = {}
+    hits = collections.Counter()
+
+    @classmethod
+    def classify(cls, line) :
+        if line[:1] != b'[' :
+            if line[:len(cls.open_prefix)] != cls.open_prefix :
+                cls.hits['ignored'] += 1
+                return None, None
+            kind = iperf_line_classifier.OPEN
+        else :
+            m = cls.regex_dispatch.match(line)
+            if not m :
+                cls.hits['ignored'] += 1
+                return None, None
+            if m.lastgroup == 'local' :
+                kind = iperf_line_classifier.LOCAL
+            elif m.lastgroup == 'trip' :
+                kind = iperf_line_classifier.TRIP_TIME
+            elif line[1:4] == b'SUM' :
+                # the total of parallel (-P) streams
+                kind = iperf_line_classifier.SUM
+            elif line[m.end():m.end() + 1] == b' ' :
+                # two spaces after sec are the bytes column, otherwise a PDF name follows
+                kind = iperf_line_classifier.TRAFFIC
+            else :
+                kind = iperf_line_classifier.HISTOGRAM
+        pattern = cls.patterns.get(kind)
+        if pattern is None :
+            cls.hits['ignored'] += 1
+            return None, None
+        m = pattern.match(line)
+        if m :
+            cls.hits[kind] += 1
+            return kind, m
+        cls.hits[kind + '(miss)'] += 1
+        return None, None
+
+    @classmethod
+    def interval(cls, timestamp) :
+        # ex. b'0.00-0.50' -> (0.0, 0.5)
+        start, end = timestamp.split(b'-')
+        return float(start), float(end)
+
+    @classmethod
+    def classifiers(cls) :
+        # every (sub)subclass which keeps its own hit counts
+        pending = list(iperf_line_classifier.__subclasses__())
+        while pending :
+            classifier = pending.pop(0)
+            pending.extend(classifier.__subclasses__())
+            if 'hits' in classifier.__dict__ :
+                yield classifier
+
+    @classmethod
+    def report(cls) :
+        for classifier in cls.classifiers() :
+            logging.info('{} hits {}'.format(classifier.__name__, dict(classifier.hits)))
+
+    @classmethod
+    def reset(cls) :
+        for classifier in cls.classifiers() :
+            classifier.hits.clear()
+
+class iperf_server_classifier(iperf_line_classifier):
+    open_prefix = b'Server listening'
+    hits = collections.Counter()
+    patterns = {
+        # ex. Server listening on TCP port 61003 with pid 2565
+        iperf_line_classifier.OPEN : re.compile(rb'Server listening on (?P<proto>\S+) port (?P<port>\d+) with pid (?P<pid>\d+)'),
+        # ex. [  4] local 192.168.1.1 port 61001 connected with 192.168.1.4 port 56949
+        iperf_line_classifier.LOCAL : re.compile(rb'\[\s*(?P<transferid>\d+)\]\slocal\s(?P<srcip>\S+)\sport\s(?P<srcport>[0-9]+)\sconnected with\s(?P<dstip>\S+)\sport\s(?P<dstport>[0-9]+)'),
+        # ex. [  4] 0.00-0.50 sec  657090 Bytes  10513440 bits/sec  449    449:0:0:0:0:0:0:0
+        iperf_line_classifier.TRAFFIC : re.compile(rb'\[\s*(?P<transferid>\d+)\] \s*(?P<timestamp>\S+) sec\s+(?P<bytes>[0-9]+) Bytes\s+(?P<throughput>[0-9]+) bits/sec\s+(?P<reads>[0-9]+)'),
+        # ex. [  3] 0.00-21.79 sec T8(f)-PDF: bin(w=10us):cnt(261674)=223:1,240:1,241:1 (5/95%=117/144,obl/obu=0/0)
+        # interval PDFs are the same less the (f), ex. [  3] 0.50-1.00 sec T8-PDF: bin(w=10us):cnt(6011)=...
+        iperf_line_classifier.HISTOGRAM : re.compile(rb'\[\s*(?P<transferid>\d+)\] \s*(?P<timestamp>\S+) sec\s+(?P<pdfname>[A-Za-z0-9\-]+?)(?P<final>\(f\))?-PDF: bin\(w=(?P<binwidth>[0-9]+)us\):cnt\((?P<population>[0-9]+)\)=(?P<pdf>.+)\s+\((?P<lci>[0-9\.]+)/(?P<uci>[0-9\.]+)%=(?P<lci_val>[0-9]+)/(?P<uci_val>[0-9]+),Outliers=(?P<outliers>[0-9]+),obl/obu=[0-9]+/[0-9]+\)'),
+        # ex. [  3] 0.0000-0.5259 trip-time (3WHS done->fin+finack) = 0.5597 sec
+        iperf_line_classifier.TRIP_TIME : re.compile(rb'\[\s*(?P<transferid>\d+)\].+trip\-time\s+\(3WHS\sdone\->fin\+finack\)\s=\s(?P<trip_time>\d+\.\d+)\ssec'),
+    }
+
+class iperf_client_classifier(iperf_line_classifier):
+    open_prefix = b'Client connecting'
+    hits = collections.Counter()
+    patterns = {
+        # ex. Client connecting to 192.168.100.33, TCP port 61009 with pid 1903
+        iperf_line_classifier.OPEN : re.compile(rb'Client connecting to .*, (?P<proto>\S+) port (?P<port>\d+) with pid (?P<pid>\d+)'),
+        # ex. [  3] local 192.168.1.4 port 56949 connected with 192.168.1.1 port 61001 (ct=1.37 ms)
+        iperf_line_classifier.LOCAL : re.compile(rb'\[\s*(?P<transferid>\d+)\]\slocal\s(?P<srcip>\S+)\sport\s(?P<srcport>[0-9]+)\sconnected with\s(?P<dstip>\S+)\sport\s(?P<dstport>[0-9]+)(?:.*\(ct=(?P<connect_time>\d+\.\d+) ms\))?'),
+        # ex. [  3] 0.00-0.50 sec  655620 Bytes  10489920 bits/sec  14/211        446      446K/0 us
+        iperf_line_classifier.TRAFFIC : re.compile(rb'\[\s*(?P<transferid>\d+)\] \s*(?P<timestamp>\S+) sec\s+(?P<bytes>\d+) Bytes\s+(?P<throughput>\d+) bits/sec\s+(?P<writes>\d+)/(?P<errwrites>\d+)\s+(?P<retry>\d+)\s+(?P<cwnd>\d+)K/(?P<rtt>\d+) us'),
+        # ex. [SUM] 0.00-0.50 sec  1311240 Bytes  20979840 bits/sec  28/422        892
+        iperf_line_classifier.SUM : re.compile(rb'\[SUM\] \s*(?P<timestamp>\S+) sec\s+(?P<bytes>\d+) Bytes\s+(?P<throughput>\d+) bits/sec(?:\s+(?P<writes>\d+)/(?P<errwrites>\d+)\s+(?P<retry>\d+))?'),
+    }
+
+class csv_match(object):
+    # Quacks like the re match of a TRAFFIC pattern so the protocols consume
+    # either form.  Groups -y C doesn't report (reads, writes, cwnd, ...) are 0
+    def __init__(self, groups) :
+        self._groups = groups
+
+    def group(self, name) :
+        return self._groups.get(name, b'0')
+
+class iperf_csv_classifier(iperf_line_classifier):
+    # Machine readable (-y C) reports, split on commas instead of regex matching, ex.
+    # 20181030100102.123,192.168.1.4,56949,192.168.1.1,61001,3,0.0-0.5,655620,10489920
+    # UDP servers append jitter(ms),lost,total,lost(%),out of order.  Anything
+    # not starting with a digit (e.g. the open line) goes to the regex classifier.
+    # NOTE: iperf prints the CSV interval with one decimal so sub 100 ms intervals
+    # can't be told apart
+    fallback = None
+    fields = ('localip', 'localport', 'peerip', 'peerport', 'transferid', 'timestamp', 'bytes', 'throughput', 'jitter', 'lost', 'total')
+
+    @classmethod
+    def classify(cls, line) :
+        if not line or not 48 <= line[0] <= 57 :
+            return cls.fallback.classify(line)
+        values = bytes(line).split(b',')
+        if len(values) < 9 :
+            cls.hits[iperf_line_classifier.TRAFFIC + '(miss)'] += 1
+            return None, None
+        if values[5][:1] == b'-' :
+            # transfer id -1 is the [SUM] of parallel streams
+            cls.hits[iperf_line_classifier.SUM] += 1
+            return iperf_line_classifier.SUM, csv_match(dict(zip(cls.fields, values[1:])))
+        cls.hits[iperf_line_classifier.TRAFFIC] += 1
+        return iperf_line_classifier.TRAFFIC, csv_match(dict(zip(cls.fields, values[1:])))
+
+class iperf_server_csv_classifier(iperf_csv_classifier):
+    fallback = iperf_server_classifier
+    open_prefix = iperf_server_classifier.open_prefix
+    hits = collections.Counter()
+
+class iperf_client_csv_classifier(iperf_csv_classifier):
+    fallback = iperf_client_classifier
+    open_prefix = iperf_client_classifier.open_prefix
+    hits = collections.Counter()
+
+class flow_columns(object):
+    # Growable typed column store for interval samples, one array.array per
+    # metric (one machine value per sample rather than a boxed str) plus a float
+    # timestamp column.  The columns are installed into the owning flowstats dict
+    # under their usual names so indexing, len() and iteration keep working, while
+    # view() hands analysis a zero-copy NumPy array.
+    def __init__(self, stats, columns) :
+        self._stats = stats
+        self.names = [name for name, typecode in columns]
+        for name, typecode in columns :
+            stats[name] = array.array(typecode)
+
+    def __len__(self) :
+        return len(self._stats[self.names[0]])
+
+    def append(self, *values) :
+        for name, value in zip(self.names, values) :
+            column = self._stats[name]
+            try :
+                column.append(value)
+            except BufferError :
+                # A NumPy view still exports this buffer so it can't be resized,
+                # copy on write which leaves the view as a valid snapshot
+                column = array.array(column.typecode, column)
+                column.append(value)
+                self._stats[name] = column
+
+    def extend(self, *values) :
+        # append() of whole arrays, one per column
+        for name, value in zip(self.names, values) :
+            column = self._stats[name]
+            data = np.ascontiguousarray(value, dtype=column.typecode).tobytes()
+            try :
+                column.frombytes(data)
+            except BufferError :
+                column = array.array(column.typecode, column)
+                column.frombytes(data)
+                self._stats[name] = column
+
+    def view(self, name) :
+        column = self._stats[name]
+        return np.frombuffer(column, dtype=column.typecode)
+
+class running_stats(object):
+    # Running aggregates of a sample stream (Welford's algorithm for the variance)
+    def __init__(self) :
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def update(self, value) :
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min :
+            self.min = value
+        if self.max is None or value > self.max :
+            self.max = value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    def update_batch(self, values) :
+        # update() of an array, combined with the running values per Chan et al.
+        if not len(values) :
+            return
+        values = np.asarray(values, dtype=np.float64)
+        count = self.count + len(values)
+        mean = float(values.mean())
+        delta = mean - self.mean
+        self._m2 += float(((values - mean) ** 2).sum()) + delta * delta * self.count * len(values) / count
+        self.mean += delta * len(values) / count
+        self.count = count
+        self.sum += float(values.sum())
+        low, high = float(values.min()), float(values.max())
+        if self.min is None or low < self.min :
+            self.min = low
+        if self.max is None or high > self.max :
+            self.max = high
+
+    @property
+    def variance(self) :
+        if self.count < 2 :
+            return 0.0
+        return self._m2 / (self.count - 1)
+
+    @property
+    def stdev(self) :
+        return math.sqrt(self.variance)
+
+    def __repr__(self) :
+        return 'count={} sum={} min={} max={} mean={} var={}'.format(self.count, self.sum, self.min, self.max, self.mean, self.variance)
+
+class flow_ring_columns(object):
+    # Bounded variant of flow_columns that retains only the last capacity samples
+    # in preallocated NumPy rings, plus running aggregates over every sample seen.
+    # Memory stays flat no matter how long a background flow runs.  flowstats gets
+    # a ring_column per metric which reads in chronological order.
+    class ring_column(object):
+        def __init__(self, ring, name) :
+            self._ring = ring
+            self._name = name
+
+        def __len__(self) :
+            return len(self._ring)
+
+        def __getitem__(self, index) :
+            return self._ring.view(self._name)[index]
+
+        def __iter__(self) :
+            return iter(self._ring.view(self._name))
+
+        def __repr__(self) :
+            return repr(self._ring.view(self._name))
+
+    def __init__(self, stats, columns, capacity=1024) :
+        self.capacity = int(capacity)
+        self.names = [name for name, typecode in columns]
+        self.aggregates = {}
+        self._columns = {}
+        self._next = 0
+        self._count = 0
+        for name, typecode in columns :
+            self._columns[name] = np.zeros(self.capacity, dtype=typecode)
+            self.aggregates[name] = running_stats()
+            stats[name] = flow_ring_columns.ring_column(self, name)
+
+    def __len__(self) :
+        return self._count
+
+    def append(self, *values) :
+        for name, value in zip(self.names, values) :
+            self._columns[name][self._next] = value
+            self.aggregates[name].update(value)
+        self._next = (self._next + 1) % self.capacity
+        if self._count < self.capacity :
+            self._count += 1
+
+    def extend(self, *values) :
+        # append() of whole arrays, one per column, only the last capacity are kept
+        count = len(values[0])
+        if not count :
+            return
+        kept = min(count, self.capacity)
+        slots = (self._next + count - kept + np.arange(kept)) % self.capacity
+        for name, value in zip(self.names, values) :
+            value = np.asarray(value)
+            self.aggregates[name].update_batch(value)
+            self._columns[name][slots] = value[-kept:]
+        self._next = (self._next + count) % self.capacity
+        self._count = min(self._count + count, self.capacity)
+
+    def view(self, name) :
+        # zero-copy until the ring wraps, a chronological copy after that
+        column = self._columns[name]
+        if self._count < self.capacity :
+            return column[:self._count]
+        return np.concatenate((column[self._next:], column[:self._next]))
+
+class flow_interval_join(object):
+    # Live pairing of rx and tx byte counts by interval number.  Whichever side
+    # reports an interval first waits here for the other, so samples arriving out
+    # of step between the server and client pipes are neither dropped nor paired
+    # with the wrong interval.  flowstats['flowrate'] is the latest rx/tx ratio.
+    PENDING_INTERVALS = 64
+
+    def __init__(self, stats) :
+        self._stats = stats
+        self._pending = {'tx' : {}, 'rx' : {}}
+        self.paired = 0
+        self.last = None
+
+    def add(self, direction, index, bytes) :
+        other = 'rx' if direction == 'tx' else 'tx'
+        if index not in self._pending[other] :
+            self._pending[direction][index] = bytes
+            return None
+        if direction == 'tx' :
+            txbytes, rxbytes = bytes, self._pending[other].pop(index)
+        else :
+            txbytes, rxbytes = self._pending[other].pop(index), bytes
+        ratio = (rxbytes / txbytes) if txbytes else None
+        self.paired += 1
+        self.last = (index, txbytes, rxbytes, ratio)
+        if ratio is not None :
+            self._stats['flowrate'] = round(ratio, 2)
+        self._prune(index - flow_interval_join.PENDING_INTERVALS)
+        return self.last
+
+    def add_batch(self, direction, indexes, values) :
+        # add() of arrays of samples (e.g. a replay), the latest pair is the last one
+        other = 'rx' if direction == 'tx' else 'tx'
+        pending, waiting = self._pending[direction], self._pending[other]
+        last = None
+        for index, value in zip(indexes.tolist(), values.tolist()) :
+            if index in waiting :
+                last = (index, value, waiting.pop(index))
+                self.paired += 1
+            else :
+                pending[index] = value
+        if last is None :
+            return None
+        index, value, counterpart = last
+        txbytes, rxbytes = (value, counterpart) if direction == 'tx' else (counterpart, value)
+        ratio = (rxbytes / txbytes) if txbytes else None
+        self.last = (index, txbytes, rxbytes, ratio)
+        if ratio is not None :
+            self._stats['flowrate'] = round(ratio, 2)
+        self._prune(index - flow_interval_join.PENDING_INTERVALS)
+        return self.last
+
+    def _prune(self, oldest) :
+        # intervals whose counterpart never showed up, e.g. a pipe was closed early
+        for pending in self._pending.values() :
+            if len(pending) > flow_interval_join.PENDING_INTERVALS :
+                for index in [index for index in pending if index < oldest] :
+                    del pending[index]
+
 class iperf_flow(object):
     port = 61000
     iperf = '/usr/bin/iperf'
@@ -61,13 +528,35 @@ class iperf_flow(object):
     flow_scope = ("flowstats")
     tasks = []
     flowid2name = defaultdict(str)
-
+    writer = None
+    lag_monitor = None
+    # quantiles kept per interval histogram, see add_latency_sample()
+    latency_quantiles = (0.5, 0.9, 0.99)
+    # a flow's stages through a run, see pipeline()
+    IDLE = 'idle'
+    RX_START = 'rx_start'
+    TX_START = 'tx_start'
+    TRAFFIC_CHECK = 'traffic_check'
+    TRAFFIC = 'traffic'
+    TX_STOP = 'tx_stop'
+    RX_STOP = 'rx_stop'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    # The runner methods (run, commence, cease, plot and sleep) are coroutines
+    # named a<method>, e.g. arun(), to compose with other work on one running
+    # loop (asyncio.gather with ssh_node commands, live analysis, ...).  The
+    # plain methods are blocking wrappers which drive the loop until done.
     @classmethod
     def sleep(cls, time=0, text=None, stoptext=None) :
         loop = asyncio.get_event_loop()
+        loop.run_until_complete(iperf_flow.asleep(time=time, text=text, stoptext=stoptext))
+
+    @classmethod
+    async def asleep(cls, time=0, text=None, stoptext=None) :
         if text :
             logging.info('Sleep {} ({})'.format(time, text))
-        loop.run_until_complete(asyncio.sleep(time))
+        await asyncio.sleep(time)
         if stoptext :
             logging.info('Sleep done ({})'.format(stoptext))
 
@@ -86,12 +575,34 @@ class iperf_flow(object):
             loop = asyncio.get_event_loop()
             iperf_flow.loop = asyncio.get_event_loop()
 
+    @classmethod
+    def get_writer(cls) :
+        if iperf_flow.writer is None :
+            iperf_flow.writer = async_writer()
+        return iperf_flow.writer
+
+    @classmethod
+    def get_lag_monitor(cls) :
+        if iperf_flow.lag_monitor is None :
+            iperf_flow.lag_monitor = loop_lag_monitor()
+        return iperf_flow.lag_monitor
+
     @classmethod
     def close_loop(cls, loop=None):
+        if flow_histogram.pool is not None :
+            iperf_flow.loop.run_until_complete(flow_histogram.pool.close())
+            flow_histogram.pool = None
+        if iperf_flow.writer is not None :
+            iperf_flow.writer.close()
+            iperf_flow.writer = None
         iperf_flow.loop.close()
 
     @classmethod
     def run(cls, time=None, amount=None, flows='all', sample_delay=None, io_timer=None, preclean=False, parallel=None, triptime=False) :
+        return iperf_flow.loop.run_until_complete(iperf_flow.arun(time=time, amount=amount, flows=flows, sample_delay=sample_delay, io_timer=io_timer, preclean=preclean, parallel=parallel, triptime=triptime))
+
+    @classmethod
+    async def arun(cls, time=None, amount=None, flows='all', sample_delay=None, io_timer=None, preclean=False, parallel=None, triptime=False) :
         if flows == 'all' :
             flows = iperf_flow.get_instances()
         if not flows:
@@ -104,65 +615,37 @@ class iperf_flow(object):
             hosts=list(set(hosts))
             tasks = [asyncio.ensure_future(iperf_flow.cleanup(user='root', host=host)) for host in hosts]
             try :
-                iperf_flow.loop.run_until_complete(asyncio.wait(tasks, timeout=10, loop=iperf_flow.loop))
+                await asyncio.wait(tasks, timeout=10, loop=iperf_flow.loop)
             except asyncio.TimeoutError:
                 logging.error('preclean timeout')
                 raise
 
         logging.info('flow run invoked')
-        tasks = [asyncio.ensure_future(flow.rx.start(time=time), loop=iperf_flow.loop) for flow in flows]
-        try :
-            iperf_flow.loop.run_until_complete(asyncio.wait(tasks, timeout=10, loop=iperf_flow.loop))
-        except asyncio.TimeoutError:
-            logging.error('flow server start timeout')
-            raise
-        tasks = [asyncio.ensure_future(flow.tx.start(time=time, amount=amount, parallel=parallel, triptime=triptime), loop=iperf_flow.loop) for flow in flows]
+        monitor = iperf_flow.get_lag_monitor()
+        monitor.start()
         try :
-            iperf_flow.loop.run_until_complete(asyncio.wait(tasks, timeout=10, loop=iperf_flow.loop))
-        except asyncio.TimeoutError:
-            logging.error('flow client start timeout')
-            raise
-        if sample_delay :
-            iperf_flow.sleep(time=0.3, text="ramp up", stoptext="ramp up done")
-        if io_timer :
-            tasks = [asyncio.ensure_future(flow.is_traffic(), loop=iperf_flow.loop) for flow in flows]
-            try :
-                iperf_flow.loop.run_until_complete(asyncio.wait(tasks, timeout=10, loop=iperf_flow.loop))
-            except asyncio.TimeoutError:
-                logging.error('flow traffic check timeout')
-                raise
-        if time :
-            iperf_flow.sleep(time=time, text="Running traffic start", stoptext="Stopping flows")
-            # Signal the remote iperf client sessions to stop them
-            tasks = [asyncio.ensure_future(flow.tx.signal_stop(), loop=iperf_flow.loop) for flow in flows]
-            try :
-                iperf_flow.loop.run_until_complete(asyncio.wait(tasks, timeout=3, loop=iperf_flow.loop))
-            except asyncio.TimeoutError:
-                logging.error('flow tx stop timeout')
-                raise
-
-        elif amount:
-            tasks = [asyncio.ensure_future(flow.transmit_completed(), loop=iperf_flow.loop) for flow in flows]
-            try :
-                iperf_flow.loop.run_until_complete(asyncio.wait(tasks, timeout=10, loop=iperf_flow.loop))
-            except asyncio.TimeoutError:
-                logging.error('flow tx completed timed out')
-                raise
-            logging.info('flow transmit completed')
-
-        # Now signal the remote iperf server sessions to stop them
-        tasks = [asyncio.ensure_future(flow.rx.signal_stop(), loop=iperf_flow.loop) for flow in flows]
-        try :
-            iperf_flow.loop.run_until_complete(asyncio.wait(tasks, timeout=3, loop=iperf_flow.loop))
-        except asyncio.TimeoutError:
-            logging.error('flow tx stop timeout')
-            raise
-
-       # iperf_flow.loop.close()
+            # every flow goes through its stages on its own, i.e. a slow flow only holds up itself
+            tasks = [asyncio.ensure_future(flow.pipeline(time=time, amount=amount, parallel=parallel, triptime=triptime, sample_delay=sample_delay, io_timer=io_timer), loop=iperf_flow.loop) for flow in flows]
+            await asyncio.wait(tasks, loop=iperf_flow.loop)
+        finally :
+            monitor.stop()
+        failed = [flow for flow in flows if flow.stage == iperf_flow.FAILED]
+        traffic = [flow.stage_elapsed(iperf_flow.TRAFFIC) for flow in flows if flow.stage_elapsed(iperf_flow.TRAFFIC) is not None]
+        if traffic :
+            logging.info('flow run time to all traffic {:.3f} s'.format(max(traffic)))
+        if failed :
+            logging.error('flow run failed for {}'.format(', '.join(['{}({})'.format(flow.name, flow.failure[0]) for flow in failed])))
+
+        iperf_line_classifier.report()
         logging.info('flow run finished')
+        return failed
 
     @classmethod
     def commence(cls, time=None, flows='all', sample_delay=None, io_timer=None, preclean=False) :
+        return iperf_flow.loop.run_until_complete(iperf_flow.acommence(time=time, flows=flows, sample_delay=sample_delay, io_timer=io_timer, preclean=preclean))
+
+    @classmethod
+    async def acommence(cls, time=None, flows='all', sample_delay=None, io_timer=None, preclean=False) :
         if flows == 'all' :
             flows = iperf_flow.get_instances()
         if not flows:
@@ -175,35 +658,33 @@ class iperf_flow(object):
             hosts=list(set(hosts))
             tasks = [asyncio.ensure_future(iperf_flow.cleanup(user='root', host=host)) for host in hosts]
             try :
-                iperf_flow.loop.run_until_complete(asyncio.wait(tasks, timeout=10, loop=iperf_flow.loop))
+                await asyncio.wait(tasks, timeout=10, loop=iperf_flow.loop)
             except asyncio.TimeoutError:
                 logging.error('preclean timeout')
                 raise
 
         logging.info('flow start invoked')
-        tasks = [asyncio.ensure_future(flow.rx.start(time=time), loop=iperf_flow.loop) for flow in flows]
-        try :
-            iperf_flow.loop.run_until_complete(asyncio.wait(tasks, timeout=10, loop=iperf_flow.loop))
-        except asyncio.TimeoutError:
-            logging.error('flow server start timeout')
-            raise
-        tasks = [asyncio.ensure_future(flow.tx.start(time=time), loop=iperf_flow.loop) for flow in flows]
-        try :
-            iperf_flow.loop.run_until_complete(asyncio.wait(tasks, timeout=10, loop=iperf_flow.loop))
-        except asyncio.TimeoutError:
-            logging.error('flow client start timeout')
-            raise
+        tasks = [asyncio.ensure_future(flow.launch(time=time), loop=iperf_flow.loop) for flow in flows]
+        await asyncio.wait(tasks, loop=iperf_flow.loop)
+        failed = [flow for flow in flows if flow.stage == iperf_flow.FAILED]
+        if failed :
+            logging.error('flow start failed for {}'.format(', '.join(['{}({})'.format(flow.name, flow.failure[0]) for flow in failed])))
+        return failed
 
     @classmethod
     def plot(cls, flows='all', title='None', directory='None') :
+        iperf_flow.loop.run_until_complete(iperf_flow.aplot(flows=flows, title=title, directory=directory))
+
+    @classmethod
+    async def aplot(cls, flows='all', title='None', directory='None') :
         if flows == 'all' :
             flows = iperf_flow.get_instances()
 
-        tasks = []
+        scheduler = flow_histogram.get_scheduler()
         for flow in flows :
             for this_name in flow.histogram_names :
                 path = directory + '/' + this_name
-                os.makedirs(path, exist_ok=True)
+                await iperf_flow.get_writer().makedirs(path)
                 i = 0
                 # group by name
                 histograms = [h for h in flow.histograms if h.name == this_name]
@@ -214,37 +695,30 @@ class iperf_flow(object):
                         histogram.output_dir = directory + '/' + this_name + '/' + this_name + str(histogram.ks_index)
 
                     logging.info('scheduling task {}'.format(histogram.output_dir))
-                    tasks.append(asyncio.ensure_future(histogram.async_plot(directory=histogram.output_dir, title=title), loop=iperf_flow.loop))
+                    key = ('histogram', histogram.uid, histogram.output_dir, title)
+                    scheduler.submit(key, lambda histogram=histogram : histogram.async_plot(directory=histogram.output_dir, title=title), priority=render_scheduler.HISTOGRAM)
                     i += 1
-        try :
-            logging.info('runnings tasks')
-            iperf_flow.loop.run_until_complete(asyncio.wait(tasks, timeout=600, loop=iperf_flow.loop))
-        except asyncio.TimeoutError:
-            logging.error('plot timed out')
-            raise
+        logging.info('runnings tasks')
+        await scheduler.adrain(timeout=600)
 
 
     @classmethod
     def cease(cls, flows='all') :
         if not iperf_flow.loop :
             iperf_flow.loop = asyncio.get_event_loop()
+        return iperf_flow.loop.run_until_complete(iperf_flow.acease(flows=flows))
 
+    @classmethod
+    async def acease(cls, flows='all') :
         if flows == 'all' :
             flows = iperf_flow.get_instances()
+        if not flows :
+            return []
 
-        # Signal the remote iperf client sessions to stop them
-        tasks = [asyncio.ensure_future(flow.tx.signal_stop(), loop=iperf_flow.loop) for flow in flows]
-        try :
-            iperf_flow.loop.run_until_complete(asyncio.wait(tasks, timeout=10, loop=iperf_flow.loop))
-        except asyncio.TimeoutError:
-            logging.error('flow tx stop timeout')
-
-        # Now signal the remote iperf server sessions to stop them
-        tasks = [asyncio.ensure_future(flow.rx.signal_stop(), loop=iperf_flow.loop) for flow in flows]
-        try :
-            iperf_flow.loop.run_until_complete(asyncio.wait(tasks, timeout=10, loop=iperf_flow.loop))
-        except asyncio.TimeoutError:
-            logging.error('flow rx stop timeout')
+        # Signal the remote iperf client then server sessions to stop them
+        tasks = [asyncio.ensure_future(flow.halt(), loop=iperf_flow.loop) for flow in flows]
+        await asyncio.wait(tasks, loop=iperf_flow.loop)
+        return [flow for flow in flows if flow.stage == iperf_flow.FAILED]
 
     @classmethod
     async def cleanup(cls, host=None, sshcmd='/usr/bin/ssh', user='root') :
@@ -283,7 +757,7 @@ class iperf_flow(object):
         }
         return switcher.get(txt.upper(), None)
 
-    def __init__(self, name='iperf', server='localhost', client = 'localhost', user = None, proto = 'TCP', dstip = '127.0.0.1', interval = 0.5, flowtime=10, offered_load = '1m', tos='BE', window='4M', src=None, srcip = None, srcport = None, dstport = None,  debug = False, udptriggers = False, length = None, latency=False, ipg=0.005, amount=None):
+    def __init__(self, name='iperf', server='localhost', client = 'localhost', user = None, proto = 'TCP', dstip = '127.0.0.1', interval = 0.5, flowtime=10, offered_load = '1m', tos='BE', window='4M', src=None, srcip = None, srcport = None, dstport = None,  debug = False, udptriggers = False, length = None, latency=False, ipg=0.005, amount=None, retention=None, arrival_times=False, csv=False, persistent=False, shared_server=False):
         iperf_flow.instances.add(self)
         if not iperf_flow.loop :
             iperf_flow.set_loop()
@@ -291,11 +765,6 @@ class iperf_flow(object):
         self.name = name
         self.latency = latency
         self.udptriggers = udptriggers;
-        if not dstport :
-            iperf_flow.port += 1
-            self.dstport = iperf_flow.port
-        else:
-            self.dstport = dstport
         self.dstip = dstip
         self.srcip = srcip
         self.srcport = srcport
@@ -303,6 +772,15 @@ class iperf_flow(object):
             self.server = server.ipaddr
         except AttributeError:
             self.server = server
+        # flows with a shared server use the one listener (and port) of the server host
+        if shared_server :
+            mux = iperf_server_mux.get(self.server, proto, dstport=dstport)
+            self.dstport = mux.dstport
+        elif not dstport :
+            iperf_flow.port += 1
+            self.dstport = iperf_flow.port
+        else:
+            self.dstport = dstport
         try :
             self.client = client.ipaddr
         except AttributeError:
@@ -331,13 +809,29 @@ class iperf_flow(object):
         self.debug = debug
         self.TRAFFIC_EVENT_TIMEOUT = round(self.interval * 4, 3)
         self.flowtime = flowtime
+        # leave the server listening between runs, only the client is started and stopped per run
+        self.persistent = persistent
         # use python composition for the server and client
         # i.e. a flow has a server and a client
         self.rx = iperf_server(name='{}->RX({})'.format(name, str(self.server)), loop=self.loop, host=self.server, flow=self, debug=self.debug)
         self.tx = iperf_client(name='{}->TX({})'.format(name, str(self.client)), loop=self.loop, host=self.client, flow=self, debug=self.debug)
         self.rx.window=window
         self.tx.window=window
+        self.rx.persistent = persistent
+        # have iperf report in CSV (-y C) which is split rather than regex matched
+        self.csv = csv
+        if self.csv :
+            self.rx.classifier = iperf_server_csv_classifier
+            self.tx.classifier = iperf_client_csv_classifier
+        if shared_server :
+            mux.register(self)
+            self.rx.mux = mux
         self.ks_critical_p = 0.01
+        # retention is the number of interval samples to keep, None keeps all of them
+        self.retention = retention
+        # also record when the controller read each interval sample (monotonic ns)
+        self.arrival_times = arrival_times
+        self.stage = iperf_flow.IDLE
         self.stats_reset()
 
     def destroy(self) :
@@ -349,28 +843,416 @@ class iperf_flow(object):
 
     def stats_reset(self) :
         # Initialize the flow stats dictionary
-        self.flowstats = {'current_rxbytes' : None , 'current_txbytes' : None , 'flowrate' : None, 'starttime' : None, 'flowid' : None, 'endtime' : None}
-        self.flowstats['txdatetime']=[]
-        self.flowstats['txbytes']=[]
-        self.flowstats['txthroughput']=[]
-        self.flowstats['writes']=[]
-        self.flowstats['errwrites']=[]
-        self.flowstats['retry']=[]
-        self.flowstats['cwnd']=[]
-        self.flowstats['rtt']=[]
-        self.flowstats['rxdatetime']=[]
-        self.flowstats['rxbytes']=[]
-        self.flowstats['rxthroughput']=[]
-        self.flowstats['reads']=[]
+        self.flowstats = {'flowrate' : None, 'starttime' : None, 'flowid' : None, 'endtime' : None}
+        # interval samples are stored as typed columns keyed by the interval iperf
+        # reports, i.e. start and end seconds relative to the start of the traffic
+        self.flowstats['txsummary'] = None
+        self.flowstats['rxsummary'] = None
+        self.flowstats['join'] = flow_interval_join(self.flowstats)
+        self.flowstats['txsamples'] = self.sample_columns(self.flowstats, 'tx')
+        self.flowstats['rxsamples'] = self.sample_columns(self.flowstats, 'rx')
+        # per stream records of a parallel (-P) client and server keyed by their transfer
+        # ids, see stream(), and the server's stream reports yet to be summed per
+        # interval, see sum_streams()
+        self.flowstats['streams'] = {}
+        self.flowstats['rxstreams'] = {}
+        self.flowstats['rxsums'] = {}
+        # (direction, transfer id) of the series whose first report was seen, see is_summary()
+        self.flowstats['first_reports'] = set()
         self.flowstats['histograms']=[]
         self.flowstats['histogram_names'] = set()
+        self.flowstats['ks_tables'] = {}
+        self.flowstats['latency'] = {}
         self.flowstats['connect_time']=[]
         self.flowstats['trip_time']=[]
+        # (stage, monotonic ns) of the last run and the (stage, reason) it failed in
+        self.flowstats['stages']=[]
+        self.flowstats['failure']=None
+
+    def sample_columns(self, stats, direction) :
+        # the interval sample store for direction 'tx' or 'rx', installed into stats
+        columns = [(direction + 'start', 'd'), (direction + 'end', 'd')]
+        if self.arrival_times :
+            columns.append((direction + 'arrival', 'q'))
+        if direction == 'tx' :
+            columns.extend([('txbytes', 'q'), ('txthroughput', 'q'), ('writes', 'I'), ('errwrites', 'I'), ('retry', 'I'), ('cwnd', 'I'), ('rtt', 'I')])
+        else :
+            columns.extend([('rxbytes', 'q'), ('rxthroughput', 'q'), ('reads', 'I')])
+        if self.retention :
+            return flow_ring_columns(stats, columns, capacity=self.retention)
+        return flow_columns(stats, columns)
+
+    def set_retention(self, samples=None) :
+        # switch between keeping every interval sample and a ring of the last samples,
+        # note this resets the flow stats
+        self.retention = samples
+        self.stats_reset()
+
+    def aggregates(self, name) :
+        # running count/sum/min/max/mean/variance of a column, only kept with a retention policy
+        for samples in [self.flowstats['txsamples'], self.flowstats['rxsamples']] :
+            if name in samples.names and hasattr(samples, 'aggregates') :
+                return samples.aggregates[name]
+        return None
+
+    def is_summary(self, direction, start, end, transferid=None) :
+        # The final report spans the whole run so it's kept out of the interval series,
+        # without interval reports the only report is the series.  Same as the server's
+        # transfer_report(), a report from 0 is the final one unless it's the first
+        # and ends at the interval, so the first reports are noted per series (the
+        # flow's or a stream's) until its final report
+        if self.interval < 0.005 or start :
+            return False
+        key = (direction, transferid)
+        # CSV intervals have one decimal
+        tolerance = 0.05 if self.csv else 0.005
+        if abs(end - self.interval) < tolerance and key not in self.flowstats['first_reports'] :
+            self.flowstats['first_reports'].add(key)
+            return False
+        self.flowstats['first_reports'].discard(key)
+        return True
+
+    def reports_reset(self, direction) :
+        # a new iperf process of the direction, none of its series reported yet
+        self.flowstats['first_reports'] = set(key for key in self.flowstats['first_reports'] if key[0] != direction)
+
+    def append_sample(self, record, direction, start, end, values, summary=None) :
+        # Append an interval sample for direction 'tx' or 'rx' to record, i.e. flowstats
+        # or a stream's record, or keep it as record[<direction>summary] when it's the
+        # final report (summary None is is_summary()).  Returns True for a sample.
+        samples = record[direction + 'samples']
+        if summary is None :
+            summary = self.is_summary(direction, start, end, record.get('transferid'))
+        if summary :
+            report = {'start' : start, 'end' : end}
+            report.update(zip(samples.names[-len(values):], values))
+            record[direction + 'summary'] = report
+            return False
+        if self.arrival_times :
+            samples.append(start, end, monotonic_ns(), *values)
+        else :
+            samples.append(start, end, *values)
+        return True
+
+    def record_sample(self, direction, start, end, values, summary=None) :
+        # append_sample() to the flow's series, which the rx/tx join pairs up
+        if not self.append_sample(self.flowstats, direction, start, end, values, summary) :
+            return False
+        # the first value of both tx and rx samples is the byte count
+        self.flowstats['join'].add(direction, self.interval_index(start), values[0])
+        return True
+
+    def add_sample(self, direction, timestamp, *values) :
+        # Add an interval sample for direction 'tx' or 'rx' using iperf's own interval
+        # timestamp, see append_sample().  Returns True for a sample.
+        start, end = iperf_line_classifier.interval(timestamp)
+        return self.record_sample(direction, start, end, values)
+
+    def add_samples(self, direction, start, end, *values) :
+        # add_sample() of arrays, one per column, e.g. from a replay
+        samples = self.flowstats[direction + 'samples']
+        if self.interval >= 0.005 :
+            # is_summary() of every sample, only the few reports from 0 need a look
+            summary = np.zeros(len(start), dtype=bool)
+            for index in np.flatnonzero(start == 0).tolist() :
+                summary[index] = self.is_summary(direction, 0.0, float(end[index]))
+            if summary.any() :
+                last = np.flatnonzero(summary)[-1]
+                record = {'start' : float(start[last]), 'end' : float(end[last])}
+                record.update(zip(samples.names[-len(values):], [int(value[last]) for value in values]))
+                self.flowstats[direction + 'summary'] = record
+                keep = ~summary
+                start, end, values = start[keep], end[keep], [value[keep] for value in values]
+        if not len(start) :
+            return
+        if self.arrival_times :
+            samples.extend(start, end, np.full(len(start), monotonic_ns(), dtype=np.int64), *values)
+        else :
+            samples.extend(start, end, *values)
+        if self.interval < 0.005 :
+            indexes = np.zeros(len(start), dtype=np.int64)
+        else :
+            indexes = np.rint(start / self.interval).astype(np.int64)
+        self.flowstats['join'].add_batch(direction, indexes, values[0])
+
+    def stream_records(self, direction='tx') :
+        # transfer id -> stream record of the client's ('tx') or the server's ('rx') streams
+        return self.flowstats['streams' if direction == 'tx' else 'rxstreams']
+
+    def stream(self, transferid, direction='tx') :
+        # The record of one stream of a parallel client ('tx') or of its server ('rx'),
+        # a dict laid out like flowstats with the direction's columns and summary and
+        # the stream's flowid
+        records = self.stream_records(direction)
+        stream = records.get(transferid)
+        if stream is None :
+            stream = {'transferid' : transferid, 'flowid' : None, direction + 'summary' : None}
+            stream[direction + 'samples'] = self.sample_columns(stream, direction)
+            records[transferid] = stream
+        return stream
+
+    def add_stream_sample(self, direction, transferid, timestamp, *values) :
+        # add_sample() for one stream of a parallel flow.  The client's [SUM] is its
+        # tx series, the server's rx series is summed from its streams, see sum_streams()
+        start, end = iperf_line_classifier.interval(timestamp)
+        sample = self.append_sample(self.stream(transferid, direction), direction, start, end, values)
+        if direction == 'rx' :
+            self.sum_streams(transferid, start, end, values, sample)
+        return sample
+
+    def sum_streams(self, transferid, start, end, values, sample) :
+        # The server's [SUM] can't be told apart per client on a shared server (nor do
+        # older servers print it), so sum each interval (and the final reports) of
+        # the streams and record it once all of the run's streams reported it.  The
+        # reports are kept per stream so a stream's second report of an interval
+        # replaces rather than adds to its first
+        key = self.interval_index(start) if sample else 'summary'
+        reports = self.flowstats['rxsums'].setdefault(key, {})
+        reports[transferid] = (start, end, values)
+        if len(reports) < (self.rx.parallel or 1) :
+            return
+        del self.flowstats['rxsums'][key]
+        if key == 'summary' :
+            # every stream is done, what's left won't complete
+            self.flush_stream_sums()
+        self.record_stream_sum(reports, key == 'summary')
+
+    def record_stream_sum(self, reports, summary) :
+        # record_sample() of the sum of stream reports, transfer id -> (start, end, values)
+        starts, ends, values = zip(*reports.values())
+        self.record_sample('rx', min(starts), max(ends), [sum(column) for column in zip(*values)], summary)
+
+    def flush_stream_sums(self) :
+        # Record the sums still waiting on streams as they are, e.g. an interval a
+        # stream ended early in or a run that stopped short of its final reports
+        pending = self.flowstats['rxsums']
+        if not pending :
+            return
+        self.flowstats['rxsums'] = {}
+        logging.debug('{} summed {} intervals of fewer than {} streams'.format(self.name, len(pending), self.rx.parallel))
+        for key in sorted(key for key in pending if key != 'summary') :
+            self.record_stream_sum(pending[key], False)
+        if 'summary' in pending :
+            self.record_stream_sum(pending['summary'], True)
+
+    def stream_direction(self, name) :
+        # 'rx' for the columns of the server's streams, e.g. rxbytes
+        return 'rx' if name in self.flowstats['rxsamples'].names else 'tx'
+
+    def stream_matrix(self, name='txbytes') :
+        # streams x intervals array of a column, in transfer id order and cut to
+        # the intervals every stream has reported
+        direction = self.stream_direction(name)
+        records = self.stream_records(direction)
+        streams = [records[transferid] for transferid in sorted(records)]
+        if not streams :
+            return np.zeros((0, 0))
+        samples = direction + 'samples'
+        length = min(len(stream[samples]) for stream in streams)
+        return np.vstack([stream[samples].view(name)[-length:] if length else stream[samples].view(name)[:0] for stream in streams])
+
+    def fairness(self, name='txbytes', per_interval=False) :
+        # Jain's fairness index across the parallel streams, 1.0 when all streams get
+        # the same and 1/n when one gets everything.  Uses each stream's summary (or
+        # mean of its intervals), per_interval gives the index of every interval,
+        # e.g. to spot one stream stalling (head of line) while the others carry on
+        if per_interval :
+            matrix = self.stream_matrix(name).astype(np.float64)
+            if not matrix.size :
+                return np.zeros(0)
+            total = matrix.sum(axis=0)
+            squares = (matrix * matrix).sum(axis=0)
+            with np.errstate(invalid='ignore', divide='ignore') :
+                return np.where(squares > 0, total * total / (len(matrix) * squares), 1.0)
+        shares = []
+        direction = self.stream_direction(name)
+        summary, samples = direction + 'summary', direction + 'samples'
+        for stream in self.stream_records(direction).values() :
+            if stream[summary] is not None and name in stream[summary] :
+                shares.append(stream[summary][name])
+            elif len(stream[samples]) :
+                shares.append(stream[samples].view(name).mean())
+        if not shares :
+            return None
+        shares = np.array(shares, dtype=np.float64)
+        squares = (shares * shares).sum()
+        if not squares :
+            return 1.0
+        return float(shares.sum() ** 2 / (len(shares) * squares))
+
+    def add_latency_sample(self, name, timestamp, histogram) :
+        # Record an interval (non-final) PDF as population, latency_quantiles (ms) and
+        # outliers, i.e. a latency time series per histogram name, and drop its bins
+        series = self.flowstats['latency'].get(name)
+        if series is None :
+            columns = [('start', 'd'), ('end', 'd'), ('population', 'q')]
+            columns.extend([(iperf_flow.quantile_name(q), 'd') for q in iperf_flow.latency_quantiles])
+            columns.append(('outliers', 'q'))
+            if self.retention :
+                series = flow_ring_columns({}, columns, capacity=self.retention)
+            else :
+                series = flow_columns({}, columns)
+            self.flowstats['latency'][name] = series
+        start, end = iperf_line_classifier.interval(timestamp)
+        series.append(start, end, histogram.population, *(histogram.quantile(list(iperf_flow.latency_quantiles)).tolist() + [int(histogram.outliers)]))
+
+    @classmethod
+    def quantile_name(cls, q) :
+        # ex. 0.99 -> 'p99', 0.999 -> 'p99.9'
+        return 'p{:g}'.format(q * 100)
+
+    def latency_series(self, name) :
+        # the interval latency records of histogram name as NumPy arrays, ex.
+        # flow.latency_series('T8')['p99']
+        series = self.flowstats['latency'][name]
+        return {column : series.view(column) for column in series.names}
+
+    def latency_spikes(self, name, quantile=0.99, factor=2.0) :
+        # indices of the intervals where the quantile exceeds factor times its median over the run
+        values = self.latency_series(name)[iperf_flow.quantile_name(quantile)]
+        if not len(values) :
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(values > factor * np.median(values))
+
+    def interval_index(self, start) :
+        if self.interval < 0.005 :
+            return 0
+        return int(round(start / self.interval))
+
+    def interval_join(self) :
+        # Pair the rx and tx series by interval number over the whole run and derive
+        # per-interval delivery ratio, loss (tx minus rx bytes, negative when the
+        # receiver drains a backlog) and goodput in bits/sec
+        if self.interval < 0.005 :
+            txindex = np.zeros(len(self.flowstats['txsamples']), dtype=np.int64)
+            rxindex = np.zeros(len(self.flowstats['rxsamples']), dtype=np.int64)
+        else :
+            txindex = np.rint(self.view('txstart') / self.interval).astype(np.int64)
+            rxindex = np.rint(self.view('rxstart') / self.interval).astype(np.int64)
+        index, txix, rxix = np.intersect1d(txindex, rxindex, return_indices=True)
+        txbytes = self.view('txbytes')[txix].astype(np.float64)
+        rxbytes = self.view('rxbytes')[rxix].astype(np.float64)
+        duration = self.view('rxend')[rxix] - self.view('rxstart')[rxix]
+        with np.errstate(divide='ignore', invalid='ignore') :
+            delivery = np.where(txbytes > 0, rxbytes / txbytes, np.nan)
+            goodput = np.where(duration > 0, rxbytes * 8 / duration, np.nan)
+        return {'interval' : index, 'start' : self.view('rxstart')[rxix], 'txbytes' : txbytes, 'rxbytes' : rxbytes, 'delivery' : delivery, 'loss' : txbytes - rxbytes, 'goodput' : goodput}
+
+    def view(self, name) :
+        # zero-copy NumPy view of an interval sample column, e.g. flow.view('rtt')
+        for samples in [self.flowstats['txsamples'], self.flowstats['rxsamples']] :
+            if name in samples.names :
+                return samples.view(name)
+        raise KeyError(name)
 
     async def start(self):
-        self.flowstats = {'current_rxbytes' : None , 'current_txbytes' : None , 'flowrate' : None, 'flowid' : None}
-        await self.rx.start()
-        await self.tx.start()
+        return await self.launch()
+
+    def set_stage(self, stage) :
+        self.stage = stage
+        self.flowstats['stages'].append((stage, monotonic_ns()))
+
+    def stage_elapsed(self, stage) :
+        # seconds from the start of the last run until the flow reached the stage
+        stages = self.flowstats['stages']
+        for name, timestamp in reversed(stages) :
+            if name == stage :
+                return (timestamp - stages[0][1]) / 1e9
+        return None
+
+    async def in_stage(self, stage, coro, timeout) :
+        self.set_stage(stage)
+        return await asyncio.wait_for(coro, timeout, loop=self.loop)
+
+    def fail(self, error) :
+        if isinstance(error, asyncio.TimeoutError) :
+            reason = 'timeout'
+        else :
+            reason = repr(error)
+        self.flowstats['failure'] = (self.stage, reason)
+        logging.error('{} failed in stage {} ({})'.format(self.name, self.stage, reason))
+        self.set_stage(iperf_flow.FAILED)
+
+    async def launch(self, time=None, amount=None, parallel=None, triptime=False) :
+        # server then client start, the client as soon as this flow's server listens
+        self.flowstats['stages'] = []
+        self.flowstats['failure'] = None
+        try :
+            await self.in_stage(iperf_flow.RX_START, self.rx.start(time=time), 10)
+            # the server's streams are its transfers, see add_stream_sample()
+            # what an earlier run stopped short of first
+            self.flush_stream_sums()
+            self.rx.parallel = parallel if parallel and parallel > 1 else None
+            self.flowstats['rxstreams'] = {}
+            self.reports_reset('rx')
+            if self.rx.segmented :
+                self.rx.expect_transfers(parallel or 1)
+            await self.in_stage(iperf_flow.TX_START, self.tx.start(time=time, amount=amount, parallel=parallel, triptime=triptime), 10)
+        except asyncio.CancelledError :
+            raise
+        except Exception as error :
+            self.fail(error)
+            await self.abort()
+            return False
+        self.set_stage(iperf_flow.TRAFFIC)
+        return True
+
+    async def pipeline(self, time=None, amount=None, parallel=None, triptime=False, sample_delay=None, io_timer=None) :
+        # One flow's run.  Each stage starts once this flow's previous stage is done
+        # rather than every flow's, stage timeouts and errors fail only this flow
+        # (see flowstats['failure']) which is then stopped as far as possible.
+        if not await self.launch(time=time, amount=amount, parallel=parallel, triptime=triptime) :
+            return False
+        try :
+            if sample_delay :
+                await asyncio.sleep(0.3)
+            if io_timer :
+                await self.in_stage(iperf_flow.TRAFFIC_CHECK, self.is_traffic(), 10)
+                self.set_stage(iperf_flow.TRAFFIC)
+            if time :
+                await asyncio.sleep(time)
+                await self.in_stage(iperf_flow.TX_STOP, self.tx.signal_stop(), 3)
+            elif amount :
+                await self.in_stage(iperf_flow.TX_STOP, self.transmit_completed(), 10)
+            self.set_stage(iperf_flow.RX_STOP)
+            if self.rx.segmented :
+                # the server stays up, wait for this run's final reports instead
+                await asyncio.wait_for(self.rx.transfer_done.wait(), 3, loop=self.loop)
+            if not self.persistent :
+                await asyncio.wait_for(self.rx.signal_stop(), 3, loop=self.loop)
+        except asyncio.CancelledError :
+            raise
+        except Exception as error :
+            self.fail(error)
+            await self.abort()
+            return False
+        self.set_stage(iperf_flow.DONE)
+        return True
+
+    async def halt(self) :
+        # stop both sides whatever the stage, persistent servers included
+        try :
+            await self.in_stage(iperf_flow.TX_STOP, self.tx.signal_stop(), 10)
+            await self.in_stage(iperf_flow.RX_STOP, self.rx.signal_stop(), 10)
+        except asyncio.CancelledError :
+            raise
+        except Exception as error :
+            self.fail(error)
+            return False
+        self.set_stage(iperf_flow.DONE)
+        return True
+
+    async def abort(self) :
+        # best effort stop after a failure, a persistent server is left for the next run
+        try :
+            if not self.tx.closed.is_set() :
+                await asyncio.wait_for(self.tx.signal_stop(), 3, loop=self.loop)
+            if not self.persistent :
+                await asyncio.wait_for(self.rx.signal_stop(), 3, loop=self.loop)
+        except asyncio.CancelledError :
+            raise
+        except Exception as error :
+            logging.error('{} stop after failure ({})'.format(self.name, repr(error)))
 
     async def is_traffic(self) :
         if self.interval < 0.005 :
@@ -387,12 +1269,26 @@ class iperf_flow(object):
         await self.tx.txcompleted.wait()
 
     async def stop(self):
-        self.tx.stop()
-        self.rx.stop()
+        return await self.halt()
 
     def stats(self):
         logging.info('stats')
 
+    @classmethod
+    def merge_histograms(cls, name, flows='all', **kwargs) :
+        # one histogram of every run of name across flows, see flow_histogram.merge()
+        if flows == 'all' :
+            flows = iperf_flow.get_instances()
+        return flow_histogram.merge([h for flow in flows for h in flow.histograms if h.name == name], name=name, **kwargs)
+
+    def get_ks_table(self, name) :
+        # the (incremental) KS table of this flow's histograms with name
+        table = self.flowstats['ks_tables'].get(name)
+        if table is None :
+            table = ks_table(name, flowname=self.name, critical_p=self.ks_critical_p)
+            self.flowstats['ks_tables'][name] = table
+        return table
+
     def compute_ks_table(self, plot=True, directory='.', title=None) :
         for this_name in self.histogram_names :
             # group by name
@@ -400,17 +1296,24 @@ class iperf_flow(object):
             for index, h in enumerate(histograms) :
                 h.ks_index = index
             print('{} KS Table has {} entries'.format(self.name, len(histograms)))
-            self.condensed_distance_matrix = ([])
-
-            tasks = []
+            # rows already added as the histograms arrived are reused, only missing pairs are computed
+            table = self.get_ks_table(this_name)
+            timer = time.perf_counter()
+            computed = table.update(histograms, log=False)
+            self.condensed_distance_matrix = table.condensed
+            dmatrix = table.dmatrix
+            pmatrix = table.pmatrix
+            logging.info('{} {} KS table of {} entries, {} pairs computed in {:.3f} seconds'.format(self.name, this_name, len(table), computed, time.perf_counter() - timer))
+
+            scheduler = flow_histogram.get_scheduler()
             for rowindex, h1 in enumerate(histograms) :
                 resultstr = rowindex * 'x'
                 maxp = None
                 minp = None
-                for h2 in histograms[rowindex:] :
-                    d,p = stats.ks_2samp(h1.samples, h2.samples)
-                    if h1 is not h2 :
-                        self.condensed_distance_matrix = np.append(self.condensed_distance_matrix,d)
+                for colindex in range(rowindex, len(histograms)) :
+                    h2 = histograms[colindex]
+                    d = dmatrix[rowindex, colindex]
+                    p = pmatrix[rowindex, colindex]
                     logging.debug('D,p={},{} cp={}'.format(str(d),str(p), str(self.ks_critical_p)))
                     if not minp or p < minp :
                         minp = p
@@ -421,17 +1324,17 @@ class iperf_flow(object):
                     else :
                         resultstr += '0'
                     if plot :
-                        tasks.append(asyncio.ensure_future(flow_histogram.plot_two_sample_ks(h1=h1, h2=h2, flowname=self.name, title=title, directory=directory), loop=iperf_flow.loop))
+                        key = ('ks', self.name, h1.uid, h2.uid, directory, title)
+                        scheduler.submit(key, lambda h1=h1, h2=h2 : flow_histogram.plot_two_sample_ks(h1=h1, h2=h2, flowname=self.name, title=title, directory=directory), priority=render_scheduler.KS)
                 print('KS: {0}({1:3d}):{2} minp={3} ptest={4}'.format(this_name, rowindex, resultstr, str(minp), str(self.ks_critical_p)))
                 logging.info('KS: {0}({1:3d}):{2} minp={3} ptest={4}'.format(this_name, rowindex, resultstr, str(minp), str(self.ks_critical_p)))
-                if tasks :
-                    try :
-                        logging.debug('runnings KS table plotting coroutines for {} row {}'.format(this_name,str(rowindex)))
-                        iperf_flow.loop.run_until_complete(asyncio.wait(tasks, timeout=300, loop=iperf_flow.loop))
-                    except asyncio.TimeoutError:
-                        logging.error('plot timed out')
-                        raise
+            logging.debug('running KS table plots for {}'.format(this_name))
+            scheduler.drain(timeout=300)
             logging.info('{} {}(condensed distance matrix)\n{}'.format(self.name, this_name,self.condensed_distance_matrix))
+            import scipy.spatial.distance
+            from scipy.cluster import hierarchy
+            from scipy.cluster.hierarchy import linkage
+            plt = pyplot()
             self.linkage_matrix=linkage(self.condensed_distance_matrix, 'ward')
             try :
                 plt.figure(figsize=(18,10))
@@ -448,8 +1351,22 @@ class iperf_flow(object):
             except:
                 pass
 
+async def endpoint_opened(endpoint) :
+    # Wait for an iperf_server or iperf_client to read its open line.  One whose
+    # process (or ssh) exits first fails the start right away
+    waits = [asyncio.ensure_future(endpoint.opened.wait(), loop=endpoint.loop), asyncio.ensure_future(endpoint.closed.wait(), loop=endpoint.loop)]
+    try :
+        await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED, loop=endpoint.loop)
+    finally :
+        for wait in waits :
+            wait.cancel()
+    if not endpoint.opened.is_set() :
+        raise ConnectionError('{} exited before it opened'.format(endpoint.name))
+
 class iperf_server(object):
 
+    classifier = iperf_server_classifier
+
     class IperfServerProtocol(asyncio.SubprocessProtocol):
         def __init__(self, server, flow):
             self.__dict__['flow'] = flow
@@ -458,8 +1375,8 @@ class iperf_server(object):
             self._closed_stderr = False
             self._mypid = None
             self._server = server
-            self._stdoutbuffer = ""
-            self._stderrbuffer = ""
+            self._stdout = line_framer()
+            self._stderr = line_framer()
 
         def __setattr__(self, attr, value):
             if attr in iperf_flow.flow_scope:
@@ -491,69 +1408,40 @@ class iperf_server(object):
         def pipe_data_received(self, fd, data):
             if self.debug :
                 logging.debug('{} {}'.format(fd, data))
-            data = data.decode("utf-8")
             if fd == 1:
-                self._stdoutbuffer += data
-                while "\n" in self._stdoutbuffer:
-                    line, self._stdoutbuffer = self._stdoutbuffer.split("\n", 1)
-                    self._server.adapter.info('{} (stdout,{})'.format(line, self._server.remotepid))
-                    if not self._server.opened.is_set() :
-                        m = self._server.regex_open_pid.match(line)
-                        if m :
-                            self._server.remotepid = m.group('pid')
-                            self._server.opened.set()
-                            logging.debug('{} pipe reading (stdout,{})'.format(self._server.name, self._server.remotepid))
-                    else :
-                        if self._server.proto == 'TCP' :
-                            m = self._server.regex_traffic.match(line)
-                            if m :
-                                timestamp = datetime.now()
-                                if not self._server.traffic_event.is_set() :
-                                    self._server.traffic_event.set()
-
-                                bytes = float(m.group('bytes'))
-                                if self.flowstats['current_txbytes'] :
-                                    flowrate = round((bytes / self.flowstats['current_txbytes']), 2)
-                                    # *consume* the current *txbytes* where the client pipe will repopulate on its next sample
-                                    # do this by setting the value to None
-                                    self.flowstats['current_txbytes'] = None
-                                    # logging.debug('{} flow  ratio={:.2f}'.format(self._server.name, flowrate))
-                                    self.flowstats['flowrate'] = flowrate
-                                else :
-                                    # *produce* the current *rxbytes* so the client pipe can know this event occurred
-                                    # indicate this by setting the value to value
-                                    self.flowstats['current_rxbytes'] = bytes
-                                    self.flowstats['rxdatetime'].append(timestamp)
-                                    self.flowstats['rxbytes'].append(m.group('bytes'))
-                                    self.flowstats['rxthroughput'].append(m.group('throughput'))
-                                    self.flowstats['reads'].append(m.group('reads'))
-                            else :
-                                m = self._server.regex_trip_time.match(line)
-                                if m :
-                                    self.flowstats['trip_time'].append(float(m.group('trip_time')) * 1000)
-                        else :
-                            m = self._server.regex_final_histogram_traffic.match(line)
-                            if m :
-                                timestamp = datetime.now(timezone.utc).astimezone()
-                                self.flowstats['endtime']= timestamp
-                                self.flowstats['histogram_names'].add(m.group('pdfname'))
-                                self.flowstats['histograms'].append(flow_histogram(name=m.group('pdfname'),values=m.group('pdf'), population=m.group('population'), binwidth=m.group('binwidth'), starttime=self.flowstats['starttime'], endtime=timestamp, outliers=m.group('outliers'), uci=m.group('uci'), uci_val=m.group('uci_val'), lci=m.group('lci'), lci_val=m.group('lci_val')))
-                                # logging.debug('pdf {} {}={}'.format(m.group('pdfname'), m.group('pdf'), m.group('binwidth')))
-                                logging.info('pdf {} found with bin width={} us'.format(m.group('pdfname'),  m.group('binwidth')))
-
-
+                for line in self._stdout.feed(data) :
+                    self.line_received(line)
             elif fd == 2:
-                self._stderrbuffer += data
-                while "\n" in self._stderrbuffer:
-                    line, self._stderrbuffer = self._stderrbuffer.split("\n", 1)
-                    logging.info('{} {} (stderr)'.format(self._server.name, line))
-
+                for line in self._stderr.feed(data) :
+                    logging.info('{} {} (stderr)'.format(self._server.name, str(line, 'utf-8')))
+
+        def line_received(self, line):
+            if self._server.adapter.isEnabledFor(logging.INFO) :
+                self._server.adapter.info('{} (stdout,{})'.format(str(line, 'utf-8'), self._server.remotepid))
+            kind, m = self._server.classifier.classify(line)
+            if not self._server.opened.is_set() :
+                if kind == iperf_line_classifier.OPEN and m.group('proto').decode() == self._server.proto and int(m.group('port')) == self._server.dstport :
+                    self._server.remotepid = m.group('pid').decode()
+                    self._server.opened.set()
+                    if self._server.flow is not None :
+                        # a shared server's flows do this as they launch
+                        self._server.flow.reports_reset('rx')
+                    logging.debug('{} pipe reading (stdout,{})'.format(self._server.name, self._server.remotepid))
+            else :
+                self._server.report_received(kind, m)
 
         def pipe_connection_lost(self, fd, exc):
             if fd == 1:
+                # a last line without a newline
+                for line in self._stdout.flush() :
+                    self.line_received(line)
+                if self._server.flow is not None :
+                    self._server.flow.flush_stream_sums()
                 self._closed_stdout = True
                 logging.debug('stdout pipe to {} closed (exception={})'.format(self._server.name, exc))
             elif fd == 2:
+                for line in self._stderr.flush() :
+                    logging.info('{} {} (stderr)'.format(self._server.name, str(line, 'utf-8')))
                 self._closed_stderr = True
                 logging.debug('stderr pipe to {} closed (exception={})'.format(self._server.name, exc))
             if self._closed_stdout and self._closed_stderr :
@@ -583,32 +1471,41 @@ class iperf_server(object):
         self.closed = asyncio.Event(loop=self.loop)
         self.closed.set()
         self.traffic_event = asyncio.Event(loop=self.loop)
+        # a persistent server is a listener left up across runs, a server with a
+        # mux shares the host's listener with other flows.  Either way each run's
+        # connections (transfer ids) are told apart, see expect_transfers()
+        self.persistent = False
+        self.mux = None
+        self.transfer_done = asyncio.Event(loop=self.loop)
+        # the client's -P, see iperf_flow.launch()
+        self.parallel = None
+        self.transfers = {}
+        self.first_reports = set()
+        self.expected_transfers = 0
         self._transport = None
         self._protocol = None
         self.time = time
         conn_id = '{}'.format(self.name)
         self.adapter = self.CustomAdapter(logger, {'connid': conn_id})
 
-        # ex. [  4] 0.00-0.50 sec  657090 Bytes  10513440 bits/sec  449    449:0:0:0:0:0:0:0
-        self.regex_traffic = re.compile(r'\[\s+\d+] (?P<timestamp>.*) sec\s+(?P<bytes>[0-9]+) Bytes\s+(?P<throughput>[0-9]+) bits/sec\s+(?P<reads>[0-9]+)')
-        #ex. [  3] 0.00-21.79 sec T8(f)-PDF: bin(w=10us):cnt(261674)=223:1,240:1,241:1 (5/95%=117/144,obl/obu=0/0)
-        self.regex_final_histogram_traffic = re.compile(r'\[\s*\d+\] (?P<timestamp>.*) sec\s+(?P<pdfname>[A-Za-z0-9\-]+)\(f\)-PDF: bin\(w=(?P<binwidth>[0-9]+)us\):cnt\((?P<population>[0-9]+)\)=(?P<pdf>.+)\s+\((?P<lci>[0-9\.]+)/(?P<uci>[0-9\.]+)%=(?P<lci_val>[0-9]+)/(?P<uci_val>[0-9]+),Outliers=(?P<outliers>[0-9]+),obl/obu=[0-9]+/[0-9]+\)')
-        # 0.0000-0.5259 trip-time (3WHS done->fin+finack) = 0.5597 sec
-        self.regex_trip_time = re.compile(r'.+trip\-time\s+\(3WHS\sdone\->fin\+finack\)\s=\s(?P<trip_time>\d+\.\d+)\ssec')
-
     def __getattr__(self, attr):
         return getattr(self.flow, attr)
 
+    @property
+    def segmented(self) :
+        return self.persistent or self.mux is not None
+
     async def start(self, time=time):
+        if self.mux is not None :
+            await self.mux.attach(self)
+            self.opened.set()
+            return
         if not self.closed.is_set() :
             return
 
-        # ex. Server listening on TCP port 61003 with pid 2565
-        self.regex_open_pid = re.compile(r'^Server listening on {} port {} with pid (?P<pid>\d+)'.format(self.proto, str(self.dstport)))
-
         self.opened.clear()
         self.remotepid = None
-        if time :
+        if time and not self.persistent :
             iperftime = time + 30
             self.sshcmd=[self.ssh, self.user + '@' + self.host, self.iperf, '-s', '-p ' + str(self.dstport), '-e',  '-t ' + str(iperftime), '-z', '-fb', '-w' , self.window]
         else :
@@ -619,12 +1516,104 @@ class iperf_server(object):
             self.sshcmd.extend(['-u'])
         if self.udptriggers or self.latency :
             self.sshcmd.extend(['--udp-histogram=10u,200000'])
+        if self.csv :
+            # CSV output has no settings report, so no pid.  Have the remote shell
+            # print the usual open line with its own pid then exec iperf (same pid)
+            self.sshcmd.extend(['-y', 'C'])
+            self.sshcmd[2:2] = ['echo', '"Server listening on {} port {} with pid $$";'.format(self.proto, self.dstport), 'exec']
 
         logging.info('{}'.format(str(self.sshcmd)))
         self._transport, self._protocol = await self.loop.subprocess_exec(lambda: self.IperfServerProtocol(self, self.flow), *self.sshcmd)
-        await self.opened.wait()
+        await endpoint_opened(self)
+
+    def report_received(self, kind, m) :
+        # a classified line once the server is listening
+        if self.segmented and not self.in_transfer(kind, m) :
+            # a line of an earlier run (or no transfer at all)
+            return
+        if self.proto == 'TCP' or self.csv :
+            # only CSV reports give a (common) traffic format for UDP servers
+            if kind == iperf_line_classifier.TRAFFIC :
+                if not self.traffic_event.is_set() :
+                    self.traffic_event.set()
+                values = (int(m.group('bytes')), int(m.group('throughput')), int(m.group('reads')))
+                if self.parallel :
+                    # each stream has its own record, the flow's series is their sum
+                    self.flow.add_stream_sample('rx', int(m.group('transferid')), m.group('timestamp'), *values)
+                else :
+                    self.flow.add_sample('rx', m.group('timestamp'), *values)
+            elif kind == iperf_line_classifier.TRIP_TIME :
+                self.flowstats['trip_time'].append(float(m.group('trip_time')) * 1000)
+        if self.proto != 'TCP' and kind == iperf_line_classifier.HISTOGRAM and not m.group('final') :
+            # keep only a compact record of an interval PDF, see add_latency_sample()
+            self.flow.add_latency_sample(m.group('pdfname').decode(), m.group('timestamp'), flow_histogram(name=m.group('pdfname').decode(), values=m.group('pdf').decode(), population=m.group('population'), binwidth=m.group('binwidth'), outliers=m.group('outliers').decode()))
+        elif self.proto != 'TCP' and kind == iperf_line_classifier.HISTOGRAM :
+            timestamp = datetime.now(timezone.utc).astimezone()
+            pdfname = m.group('pdfname').decode()
+            self.flowstats['endtime']= timestamp
+            self.flowstats['histogram_names'].add(pdfname)
+            self.flowstats['histograms'].append(flow_histogram(name=pdfname,values=m.group('pdf').decode(), population=m.group('population'), binwidth=m.group('binwidth'), starttime=self.flowstats['starttime'], endtime=timestamp, outliers=m.group('outliers').decode(), uci=m.group('uci').decode(), uci_val=m.group('uci_val').decode(), lci=m.group('lci').decode(), lci_val=m.group('lci_val').decode()))
+            # live KS row, i.e. is this run different from the earlier ones, computed off the loop when there is one
+            if self.loop is not None and self.loop.is_running() :
+                self.flow.get_ks_table(pdfname).add_later(self.flowstats['histograms'][-1], self.loop)
+            else :
+                self.flow.get_ks_table(pdfname).add(self.flowstats['histograms'][-1])
+            # logging.debug('pdf {} {}={}'.format(pdfname, m.group('pdf'), m.group('binwidth')))
+            logging.info('pdf {} found with bin width={} us'.format(pdfname,  m.group('binwidth').decode()))
+        if self.segmented and kind in (iperf_line_classifier.TRAFFIC, iperf_line_classifier.TRIP_TIME) :
+            self.transfer_report(kind, m)
+
+    def expect_transfers(self, count=1) :
+        # the next count connections to a persistent server are this run's,
+        # i.e. the client's -P
+        self.transfers = {}
+        self.first_reports = set()
+        self.expected_transfers = count
+        self.transfer_done.clear()
+
+    def in_transfer(self, kind, m) :
+        # True when the line belongs to one of this run's transfers.  A transfer is
+        # claimed by its local line, i.e. a new connection (CSV has no local line so
+        # its first report).  Transfer ids are socket fds, a later run may reuse them
+        if kind is None or kind == iperf_line_classifier.OPEN :
+            return False
+        transferid = int(m.group('transferid'))
+        if transferid in self.transfers :
+            return True
+        if len(self.transfers) >= self.expected_transfers :
+            return False
+        if kind == iperf_line_classifier.LOCAL or (self.csv and kind == iperf_line_classifier.TRAFFIC) :
+            self.transfers[transferid] = False
+            return True
+        return False
+
+    def transfer_report(self, kind, m) :
+        # A transfer ends with its final report, which is cumulative, i.e. starts at 0
+        # like only the first interval report does.  So a report from 0 is the final
+        # one unless it's the first and ends at the interval (a transfer shorter than
+        # the interval has only the final report).  The trip time iperf -e prints as
+        # a TCP connection closes ends it too.  The run is done when all of its transfers are
+        transferid = int(m.group('transferid'))
+        if transferid not in self.transfers :
+            return
+        if kind == iperf_line_classifier.TRAFFIC :
+            start, end = iperf_line_classifier.interval(m.group('timestamp'))
+            if start :
+                return
+            # CSV intervals have one decimal
+            tolerance = 0.05 if self.csv else 0.005
+            if self.interval >= 0.005 and abs(end - self.interval) < tolerance and transferid not in self.first_reports :
+                self.first_reports.add(transferid)
+                return
+        self.transfers[transferid] = True
+        if len(self.transfers) >= self.expected_transfers and all(self.transfers.values()) :
+            self.transfer_done.set()
 
     async def signal_stop(self):
+        if self.mux is not None :
+            self.opened.clear()
+            await self.mux.release(self)
+            return
         if self.remotepid :
             childprocess = await asyncio.create_subprocess_exec(self.ssh, '{}@{}'.format(self.user, self.host), 'kill', '-HUP', '{}'.format(self.remotepid), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, loop=self.loop)
             logging.debug('({}) sending signal HUP to {} (pid={})'.format(self.user, self.host, self.remotepid))
@@ -635,8 +1624,133 @@ class iperf_server(object):
                 await self.closed.wait()
 
 
+class iperf_server_mux(iperf_server):
+    # One iperf -s per (host, proto) serving every flow created with
+    # shared_server=True, i.e. remote processes and pipes scale with hosts
+    # rather than flows.  The flows share the mux's dstport and each keeps its
+    # own iperf_server for its stats.  Lines are routed by transfer id to the
+    # flow whose client owns the peer address of that transfer, the client
+    # claims its source address when it reads its local line.  Lines for a
+    # peer not yet claimed wait in a pending buffer.  The server options are
+    # the flows', those which can't differ per connection must match.
+    instances = {}
+    pending_lines = 256
+
+    @classmethod
+    def get(cls, host, proto, dstport=None) :
+        mux = iperf_server_mux.instances.get((host, proto))
+        if mux is None :
+            if not dstport :
+                iperf_flow.port += 1
+                dstport = iperf_flow.port
+            mux = iperf_server_mux(host=host, proto=proto, dstport=dstport)
+            iperf_server_mux.instances[(host, proto)] = mux
+        elif dstport and dstport != mux.dstport :
+            raise ValueError('{} already listens on port {}'.format(mux.name, mux.dstport))
+        return mux
+
+    @classmethod
+    def peer(cls, ip, port) :
+        # ex. (b'::ffff:192.168.1.4', b'56949') -> (IPv4Address('192.168.1.4'), 56949)
+        address = ipaddress.ip_address(ip.decode())
+        if address.version == 6 and address.ipv4_mapped :
+            address = address.ipv4_mapped
+        return address, int(port)
+
+    def __init__(self, host='localhost', proto='TCP', dstport=None) :
+        iperf_server.__init__(self, name='RX({}:{} {})'.format(host, dstport, proto), loop=iperf_flow.loop, host=host)
+        self.proto = proto
+        self.dstport = dstport
+        self.persistent = True
+        self.flows = []
+        self.servers = set()
+        self.transfer_peers = {}
+        self.peers = {}
+        self.pending = {}
+        self._starting = None
+
+    def register(self, flow) :
+        if self.flows :
+            lead = self.flows[0]
+            if flow.interval != lead.interval or flow.csv != lead.csv :
+                raise ValueError('{} interval={} csv={} differs from the flows on {}'.format(flow.name, flow.interval, flow.csv, self.name))
+        if flow not in self.flows :
+            self.flows.append(flow)
+        # a long lived mux may have seen this flow's transfer ids (fds) before, start
+        # it with no transfers or peers, launch() then expects each run's
+        flow.rx.expect_transfers(0)
+        for peer in [peer for peer, owner in self.peers.items() if owner is flow.rx] :
+            del self.peers[peer]
+
+    def configure(self) :
+        # the listener's options from its flows
+        lead = self.flows[0]
+        self.user = lead.user
+        self.window = lead.rx.window
+        self.interval = lead.interval
+        self.csv = lead.csv
+        self.classifier = lead.rx.classifier
+        self.udptriggers = any(flow.udptriggers for flow in self.flows)
+        self.latency = any(flow.latency for flow in self.flows)
+
+    async def attach(self, server) :
+        self.servers.add(server)
+        if self._starting is None and self.closed.is_set() :
+            self.configure()
+            self.transfer_peers.clear()
+            self.pending.clear()
+            self._starting = asyncio.ensure_future(self.start(), loop=self.loop)
+        if self._starting is not None :
+            try :
+                await asyncio.shield(self._starting)
+            finally :
+                self._starting = None
+
+    async def release(self, server) :
+        self.servers.discard(server)
+        for peer in [peer for peer, owner in self.peers.items() if owner is server] :
+            del self.peers[peer]
+        if not self.servers :
+            await self.signal_stop()
+
+    def claim(self, server, ip, port) :
+        # the client side of a flow read its source address
+        peer = iperf_server_mux.peer(ip, port)
+        if self.peers.get(peer) is server :
+            return
+        self.peers[peer] = server
+        for kind, m in self.pending.pop(peer, ()) :
+            server.report_received(kind, m)
+
+    def report_received(self, kind, m) :
+        if kind is None or kind == iperf_line_classifier.OPEN :
+            return
+        transferid = int(m.group('transferid'))
+        if kind == iperf_line_classifier.LOCAL :
+            # transfer ids can be reused, the latest local line wins
+            peer = iperf_server_mux.peer(m.group('dstip'), m.group('dstport'))
+            self.transfer_peers[transferid] = peer
+        elif self.csv and kind == iperf_line_classifier.TRAFFIC :
+            peer = iperf_server_mux.peer(m.group('peerip'), m.group('peerport'))
+            self.transfer_peers[transferid] = peer
+        else :
+            peer = self.transfer_peers.get(transferid)
+            if peer is None :
+                return
+        server = self.peers.get(peer)
+        if server is None :
+            pending = self.pending.get(peer)
+            if pending is None :
+                pending = collections.deque(maxlen=iperf_server_mux.pending_lines)
+                self.pending[peer] = pending
+            pending.append((kind, m))
+        else :
+            server.report_received(kind, m)
+
 class iperf_client(object):
 
+    classifier = iperf_client_classifier
+
     # Asyncio protocol for subprocess transport
     class IperfClientProtocol(asyncio.SubprocessProtocol):
         def __init__(self, client, flow):
@@ -646,8 +1760,8 @@ class iperf_client(object):
             self._closed_stderr = False
             self._mypid = None
             self._client = client
-            self._stdoutbuffer = ""
-            self._stderrbuffer = ""
+            self._stdout = line_framer()
+            self._stderr = line_framer()
 
         def __setattr__(self, attr, value):
             if attr in iperf_flow.flow_scope:
@@ -678,99 +1792,112 @@ class iperf_client(object):
         def pipe_data_received(self, fd, data):
             if self.debug :
                 logging.debug('{} {}'.format(fd, data))
-            data = data.decode("utf-8")
             if fd == 1:
-                self._stdoutbuffer += data
-                while "\n" in self._stdoutbuffer:
-                    line, self._stdoutbuffer = self._stdoutbuffer.split("\n", 1)
-                    self._client.adapter.info('{} (stdout,{})'.format(line, self._client.remotepid))
-                    if not self._client.opened.is_set() :
-                        m = self._client.regex_open_pid.match(line)
-                        if m :
-                            self._client.opened.set()
-                            self._client.remotepid = m.group('pid')
-                            self.flowstats['starttime'] = datetime.now(timezone.utc).astimezone()
-                            logging.debug('{} pipe reading at {} (stdout,{})'.format(self._client.name, self.flowstats['starttime'].isoformat(), self._client.remotepid))
-                    else :
-                        if self.flowstats['flowid'] is None :
-                            m = self._client.regex_flowid.match(line)
-                            if m :
-                                # self.regex_flowid = re.compile(r'local\s(?P<srcip>[0-9]{0,3}\.[0-9]{0,3}\.[0-9]{0,3}\.[0-9]{0,3})\sport\s(?P<srcport>[0-9]+)\sconnected with\s(?P<dstip>[0-9]{0,3}\.[0-9]{0,3}\.[0-9]{0,3}\.[0-9]{0,3})\sport\s(?P<dstport>[0-9]+)')
-                                #
-                                # temp = htonl(config->src_ip);
-                                # checksum ^= bcm_compute_xor32((volatile uint32 *)&temp, sizeof(temp) / sizeof(uint32));
-                                # temp = htonl(config->dst_ip);
-                                # checksum ^= bcm_compute_xor32((volatile uint32 *)&temp, sizeof(temp) / sizeof(uint32));
-                                # temp = (hton16(config->dst_port) << 16) | hton16(config->src_port);
-                                # checksum ^= bcm_compute_xor32((volatile uint32 *)&temp, sizeof(temp) / sizeof(uint32));
-                                # temp = config->proto;
-                                # checksum ^= bcm_compute_xor32((volatile uint32 *)&temp, sizeof(temp) / sizeof(uint32));
-                                # return "%08x" % netip
-                                # NOTE: the network or big endian byte order
-                                srcipaddr = ipaddress.ip_address(m.group('srcip'))
-                                srcip32 = ctypes.c_uint32(int.from_bytes(srcipaddr.packed, byteorder='little', signed=False))
-                                dstipaddr = ipaddress.ip_address(m.group('dstip'))
-                                dstip32 = ctypes.c_uint32(int.from_bytes(dstipaddr.packed, byteorder='little', signed=False))
-                                dstportbytestr = int(m.group('dstport')).to_bytes(2, byteorder='big', signed=False)
-                                dstport16 = ctypes.c_uint16(int.from_bytes(dstportbytestr, byteorder='little', signed=False))
-                                srcportbytestr = int(m.group('srcport')).to_bytes(2, byteorder='big', signed=False)
-                                srcport16 = ctypes.c_uint16(int.from_bytes(srcportbytestr, byteorder='little', signed=False))
-                                ports32 = ctypes.c_uint32((dstport16.value << 16) | srcport16.value)
-                                if self._client.proto == 'UDP':
-                                    proto32 = ctypes.c_uint32(0x11)
-                                else :
-                                    proto32 = ctypes.c_uint32(0x06)
-                                quintuplehash = srcip32.value ^ dstip32.value ^ ports32.value ^ proto32.value
-                                self.flowstats['flowid'] = '0x{:08x}'.format(quintuplehash)
-                                iperf_flow.flowid2name[self.flowstats['flowid']] = self._client.name
-                                logging.info('Flow hash = {} uses name {}'.format(self.flowstats['flowid'], self._client.name))
-
-                        if self._client.proto == 'TCP':
-                            m = self._client.regex_traffic.match(line)
-                            if m :
-                                timestamp = datetime.now()
-                                if not self._client.traffic_event.is_set() :
-                                    self._client.traffic_event.set()
-
-                                bytes = float(m.group('bytes'))
-                                if self.flowstats['current_rxbytes'] :
-                                    flowrate = round((self.flowstats['current_rxbytes'] / bytes), 2)
-                                    # *consume* the current *rxbytes* where the server pipe will repopulate on its next sample
-                                    # do this by setting the value to None
-                                    self.flowstats['current_rxbytes'] = None
-                                    # logging.debug('{} flow ratio={:.2f}'.format(self._client.name, flowrate))
-                                    self.flowstats['flowrate'] = flowrate
-                                else :
-                                    # *produce* the current txbytes so the server pipe can know this event occurred
-                                    # indicate this by setting the value to value
-                                    self.flowstats['current_txbytes'] = bytes
-
-                                self.flowstats['txdatetime'].append(timestamp)
-                                self.flowstats['txbytes'].append(m.group('bytes'))
-                                self.flowstats['txthroughput'].append(m.group('throughput'))
-                                self.flowstats['writes'].append(m.group('writes'))
-                                self.flowstats['errwrites'].append(m.group('errwrites'))
-                                self.flowstats['retry'].append(m.group('retry'))
-                                self.flowstats['cwnd'].append(m.group('cwnd'))
-                                self.flowstats['rtt'].append(m.group('rtt'))
-                            else :
-                                m = self._client.regex_connect_time.match(line)
-                                if m :
-                                    self.flowstats['connect_time'].append(float(m.group('connect_time')))
-                        else :
-                            pass
-
+                for line in self._stdout.feed(data) :
+                    self.line_received(line)
             elif fd == 2:
-                self._stderrbuffer += data
-                while "\n" in self._stderrbuffer:
-                    line, self._stderrbuffer = self._stderrbuffer.split("\n", 1)
-                    logging.info('{} {} (stderr)'.format(self._client.name, line))
+                for line in self._stderr.feed(data) :
+                    logging.info('{} {} (stderr)'.format(self._client.name, str(line, 'utf-8')))
+
+        def line_received(self, line):
+            if self._client.adapter.isEnabledFor(logging.INFO) :
+                self._client.adapter.info('{} (stdout,{})'.format(str(line, 'utf-8'), self._client.remotepid))
+            kind, m = self._client.classifier.classify(line)
+            if not self._client.opened.is_set() :
+                if kind == iperf_line_classifier.OPEN and m.group('proto').decode() == self._client.proto and int(m.group('port')) == self._client.dstport :
+                    self._client.opened.set()
+                    self._client.remotepid = m.group('pid').decode()
+                    self._client.flow.reports_reset('tx')
+                    self.flowstats['starttime'] = datetime.now(timezone.utc).astimezone()
+                    logging.debug('{} pipe reading at {} (stdout,{})'.format(self._client.name, self.flowstats['starttime'].isoformat(), self._client.remotepid))
+            elif kind == iperf_line_classifier.LOCAL :
+                if self._client.flow.rx.mux is not None :
+                    self._client.flow.rx.mux.claim(self._client.flow.rx, m.group('srcip'), m.group('srcport'))
+                if self.flowstats['flowid'] is None :
+                    self.set_flowid(m)
+                if self._client.parallel :
+                    self.set_stream_flowid(m)
+                if self._client.proto == 'TCP' and m.group('connect_time') :
+                    self.flowstats['connect_time'].append(float(m.group('connect_time')))
+            elif kind == iperf_line_classifier.TRAFFIC :
+                if self._client.csv and self._client.flow.rx.mux is not None :
+                    self._client.flow.rx.mux.claim(self._client.flow.rx, m.group('localip'), m.group('localport'))
+                if self._client.csv and (self.flowstats['flowid'] is None or self._client.parallel) :
+                    # CSV has no local line, every report carries the addresses
+                    addresses = csv_match({'transferid' : m.group('transferid'), 'srcip' : m.group('localip'), 'srcport' : m.group('localport'), 'dstip' : m.group('peerip'), 'dstport' : m.group('peerport')})
+                    if self.flowstats['flowid'] is None :
+                        self.set_flowid(addresses)
+                    if self._client.parallel :
+                        self.set_stream_flowid(addresses)
+                if self._client.proto != 'TCP' :
+                    return
+                if not self._client.traffic_event.is_set() :
+                    self._client.traffic_event.set()
+                values = (int(m.group('bytes')), int(m.group('throughput')), int(m.group('writes')), int(m.group('errwrites')), int(m.group('retry')), int(m.group('cwnd')), int(m.group('rtt')))
+                if self._client.parallel :
+                    # each stream has its own record, the flow's series is the [SUM]
+                    self.flow.add_stream_sample('tx', int(m.group('transferid')), m.group('timestamp'), *values)
+                else :
+                    self.flow.add_sample('tx', m.group('timestamp'), *values)
+            elif kind == iperf_line_classifier.SUM :
+                if self._client.proto != 'TCP' or not self._client.parallel :
+                    return
+                # no per stream cwnd or rtt in a sum
+                self.flow.add_sample('tx', m.group('timestamp'), int(m.group('bytes')), int(m.group('throughput')), int(m.group('writes') or 0), int(m.group('errwrites') or 0), int(m.group('retry') or 0), 0, 0)
+
+        def quintuple_hash(self, m) :
+            # m has the srcip, srcport, dstip and dstport groups
+            # temp = htonl(config->src_ip);
+            # checksum ^= bcm_compute_xor32((volatile uint32 *)&temp, sizeof(temp) / sizeof(uint32));
+            # temp = htonl(config->dst_ip);
+            # checksum ^= bcm_compute_xor32((volatile uint32 *)&temp, sizeof(temp) / sizeof(uint32));
+            # temp = (hton16(config->dst_port) << 16) | hton16(config->src_port);
+            # checksum ^= bcm_compute_xor32((volatile uint32 *)&temp, sizeof(temp) / sizeof(uint32));
+            # temp = config->proto;
+            # checksum ^= bcm_compute_xor32((volatile uint32 *)&temp, sizeof(temp) / sizeof(uint32));
+            # return "%08x" % netip
+            # NOTE: the network or big endian byte order
+            srcipaddr = ipaddress.ip_address(m.group('srcip').decode())
+            srcip32 = ctypes.c_uint32(int.from_bytes(srcipaddr.packed, byteorder='little', signed=False))
+            dstipaddr = ipaddress.ip_address(m.group('dstip').decode())
+            dstip32 = ctypes.c_uint32(int.from_bytes(dstipaddr.packed, byteorder='little', signed=False))
+            dstportbytestr = int(m.group('dstport')).to_bytes(2, byteorder='big', signed=False)
+            dstport16 = ctypes.c_uint16(int.from_bytes(dstportbytestr, byteorder='little', signed=False))
+            srcportbytestr = int(m.group('srcport')).to_bytes(2, byteorder='big', signed=False)
+            srcport16 = ctypes.c_uint16(int.from_bytes(srcportbytestr, byteorder='little', signed=False))
+            ports32 = ctypes.c_uint32((dstport16.value << 16) | srcport16.value)
+            if self._client.proto == 'UDP':
+                proto32 = ctypes.c_uint32(0x11)
+            else :
+                proto32 = ctypes.c_uint32(0x06)
+            quintuplehash = srcip32.value ^ dstip32.value ^ ports32.value ^ proto32.value
+            return '0x{:08x}'.format(quintuplehash)
+
+        def set_flowid(self, m) :
+            self.flowstats['flowid'] = self.quintuple_hash(m)
+            iperf_flow.flowid2name[self.flowstats['flowid']] = self._client.name
+            logging.info('Flow hash = {} uses name {}'.format(self.flowstats['flowid'], self._client.name))
+
+        def set_stream_flowid(self, m) :
+            # a parallel stream is its own connection so has its own hash, the
+            # first stream's is the flow's and keeps the flow's name
+            stream = self.flow.stream(int(m.group('transferid')))
+            if stream['flowid'] is not None :
+                return
+            stream['flowid'] = self.quintuple_hash(m)
+            name = iperf_flow.flowid2name.setdefault(stream['flowid'], '{}[{}]'.format(self._client.name, stream['transferid']))
+            logging.info('Flow hash = {} uses name {}'.format(stream['flowid'], name))
 
         def pipe_connection_lost(self, fd, exc):
             if fd == 1:
+                # a last line without a newline
+                for line in self._stdout.flush() :
+                    self.line_received(line)
                 logging.debug('stdout pipe to {} closed (exception={})'.format(self._client.name, exc))
                 self._closed_stdout = True
             elif fd == 2:
+                for line in self._stderr.flush() :
+                    logging.info('{} {} (stderr)'.format(self._client.name, str(line, 'utf-8')))
                 logging.debug('stderr pipe to {} closed (exception={})'.format(self._client.name, exc))
                 self._closed_stderr = True
             self.signal_exit()
@@ -799,15 +1926,11 @@ class iperf_client(object):
         self.ssh = '/usr/bin/ssh'
         self.host = host
         self.debug = debug
+        self.parallel = None
         self._transport = None
         self._protocol = None
         conn_id = '{}'.format(self.name)
         self.adapter = self.CustomAdapter(logger, {'connid': conn_id})
-        # traffic ex: [  3] 0.00-0.50 sec  655620 Bytes  10489920 bits/sec  14/211        446      446K/0 us
-        self.regex_traffic = re.compile(r'\[\s+\d+] (?P<timestamp>.*) sec\s+(?P<bytes>\d+) Bytes\s+(?P<throughput>\d+) bits/sec\s+(?P<writes>\d+)/(?P<errwrites>\d+)\s+(?P<retry>\d+)\s+(?P<cwnd>\d+)K/(?P<rtt>\d+) us')
-        self.regex_connect_time = re.compile(r'\[\s+\d+]\slocal.*\(ct=(?P<connect_time>\d+\.\d+) ms\)')
-        # local 192.168.1.4 port 56949 connected with 192.168.1.1 port 61001
-        self.regex_flowid = re.compile(r'\[\s+\d+]\slocal\s(?P<srcip>[0-9]{0,3}\.[0-9]{0,3}\.[0-9]{0,3}\.[0-9]{0,3})\sport\s(?P<srcport>[0-9]+)\sconnected with\s(?P<dstip>[0-9]{0,3}\.[0-9]{0,3}\.[0-9]{0,3}\.[0-9]{0,3})\sport\s(?P<dstport>[0-9]+)')
     def __getattr__(self, attr):
         return getattr(self.flow, attr)
 
@@ -819,9 +1942,10 @@ class iperf_client(object):
         self.txcompleted.clear()
         self.remotepid = None
         self.flowstats['flowid']=None
+        # transfer ids restart with each client so do the per stream records
+        self.flowstats['streams'] = {}
+        self.parallel = parallel if parallel and parallel > 1 else None
 
-        # Client connecting to 192.168.100.33, TCP port 61009 with pid 1903
-        self.regex_open_pid = re.compile(r'Client connecting to .*, {} port {} with pid (?P<pid>\d+)'.format(self.proto, str(self.dstport)))
         self.sshcmd=[self.ssh, self.user + '@' + self.host, self.iperf, '-c', self.dstip, '-p ' + str(self.dstport), '-e', '-fb', '-S ', iperf_flow.txt_to_tos(self.tos), '-w' , self.window ,'--realtime']
         if self.length :
             self.sshcmd.extend(['-l ', str(self.length)])
@@ -853,11 +1977,15 @@ class iperf_client(object):
                  self.sshcmd.extend(['-u', '-b', self.offered_load])
         elif self.proto == 'TCP' and self.offered_load :
             self.sshcmd.extend(['-b', self.offered_load])
+        if self.csv :
+            # see iperf_server.start()
+            self.sshcmd.extend(['-y', 'C'])
+            self.sshcmd[2:2] = ['echo', '"Client connecting to {}, {} port {} with pid $$";'.format(self.dstip, self.proto, self.dstport), 'exec']
 
         logging.info('{}'.format(str(self.sshcmd)))
         try :
             self._transport, self._protocol = await self.loop.subprocess_exec(lambda: self.IperfClientProtocol(self, self.flow), *self.sshcmd)
-            await self.opened.wait()
+            await endpoint_opened(self)
         except:
             logging.error('flow client start error')
             raise
@@ -892,6 +2020,576 @@ class iperf_client(object):
             if not self.closed.is_set():
                 await self.closed.wait()
 
+class gnuplot_pool(object):
+    # A few long lived gnuplot processes fed over stdin rather than a gnuplot
+    # process per plot.  A render is a load of the control file followed by a
+    # print of a sentinel (set print "-" sends it to stdout), which gnuplot only
+    # reaches after the plot is done.  Output is unset and the session reset
+    # between renders so one control file can't leak settings into the next.
+    # Renders go through a bounded queue, i.e. producers wait when it's full.
+    # A render without its sentinel within timeout seconds (a hung gnuplot, e.g.
+    # waiting on a pause) fails and that worker's gnuplot is killed and respawned.
+    sentinel = '__flows_render_done__'
+
+    def __init__(self, size=4, queuesize=64, gnuplot='/usr/bin/gnuplot', timeout=60, loop=None) :
+        self.size = size
+        self.gnuplot = gnuplot
+        self.timeout = timeout
+        self.loop = loop or iperf_flow.loop
+        self.queue = asyncio.Queue(maxsize=queuesize, loop=self.loop)
+        self.renders = 0
+        self.errors = 0
+        self.render_time = 0.0
+        self._workers = []
+        self._processes = []
+
+    async def render(self, gpcfilename) :
+        # render a gnuplot control file, returns any text gnuplot printed (e.g. errors)
+        if not self._workers :
+            self._workers = [asyncio.ensure_future(self._worker(index), loop=self.loop) for index in range(self.size)]
+        done = self.loop.create_future()
+        await self.queue.put((gpcfilename, done))
+        return await done
+
+    async def _spawn(self) :
+        process = await asyncio.create_subprocess_exec(self.gnuplot, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, loop=self.loop)
+        process.stdin.write('set print "-"\n'.encode())
+        self._processes.append(process)
+        return process
+
+    async def _kill(self, process) :
+        try :
+            process.kill()
+        except ProcessLookupError :
+            pass
+        await process.wait()
+        if process in self._processes :
+            self._processes.remove(process)
+
+    async def _render(self, process, gpcfilename) :
+        # the lines gnuplot printed ahead of the sentinel
+        process.stdin.write('load "{}"\nunset output\nreset\nset print "-"\nprint "{}"\n'.format(gpcfilename.replace('"', '\\"'), gnuplot_pool.sentinel).encode())
+        await process.stdin.drain()
+        output = []
+        while True :
+            line = await process.stdout.readline()
+            if not line :
+                raise EOFError('gnuplot exited rendering {}'.format(gpcfilename))
+            line = line.decode(errors='replace').rstrip()
+            if line == gnuplot_pool.sentinel :
+                return output
+            if line :
+                output.append(line)
+
+    async def _worker(self, index) :
+        process = None
+        while True :
+            gpcfilename, done = await self.queue.get()
+            try :
+                if process is None or process.returncode is not None :
+                    process = await self._spawn()
+                timer = time.perf_counter()
+                try :
+                    output = await asyncio.wait_for(self._render(process, gpcfilename), self.timeout, loop=self.loop)
+                except asyncio.TimeoutError :
+                    # killed below, the next render gets a fresh gnuplot
+                    raise asyncio.TimeoutError('no gnuplot output within {} seconds, killed it'.format(self.timeout))
+                elapsed = time.perf_counter() - timer
+                self.renders += 1
+                self.render_time += elapsed
+                if output :
+                    self.errors += 1
+                    logging.error('gnuplot({}) {} {}'.format(index, gpcfilename, ' '.join(output)))
+                else :
+                    logging.debug('gnuplot({}) rendered {} in {:.3f} seconds'.format(index, gpcfilename, elapsed))
+                if not done.done() :
+                    done.set_result('\n'.join(output))
+            except Exception as exc :
+                logging.error('gnuplot({}) {} failed: {}'.format(index, gpcfilename, exc))
+                self.errors += 1
+                if process is not None :
+                    # e.g. gnuplot exited, either way it's done with
+                    await self._kill(process)
+                    process = None
+                if not done.done() :
+                    done.set_exception(exc)
+            finally :
+                self.queue.task_done()
+
+    async def _exit(self, process) :
+        try :
+            process.stdin.write(b'exit\n')
+            await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError) :
+            pass
+        await process.wait()
+
+    async def close(self) :
+        # a gnuplot that doesn't exit within timeout seconds is killed
+        for worker in self._workers :
+            worker.cancel()
+        for process in list(self._processes) :
+            if process.returncode is None :
+                try :
+                    await asyncio.wait_for(self._exit(process), self.timeout, loop=self.loop)
+                except asyncio.TimeoutError :
+                    logging.error('gnuplot (pid={}) did not exit within {} seconds, killed it'.format(process.pid, self.timeout))
+                    await self._kill(process)
+        if self.renders :
+            logging.info('gnuplot pool rendered {} plots in {:.3f} seconds ({:.3f} per plot, {} errors)'.format(self.renders, self.render_time, self.render_time / self.renders, self.errors))
+        self._workers = []
+        self._processes = []
+
+class render_scheduler(object):
+    # Runs plot renders with at most concurrency in flight.  Jobs are queued by
+    # priority (single histograms before the pairwise KS plots) and a job whose
+    # key matches one already queued or running isn't queued again.  Progress is
+    # logged about every 10%.
+    HISTOGRAM = 0
+    KS = 1
+
+    def __init__(self, concurrency=4, loop=None) :
+        self.concurrency = concurrency
+        self.loop = loop or iperf_flow.loop
+        self.queue = asyncio.PriorityQueue(loop=self.loop)
+        self._jobs = {}
+        self._sequence = itertools.count()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.duplicates = 0
+
+    def submit(self, key, render, priority=KS) :
+        # render is called (to get its coroutine) only when the job gets a slot,
+        # returns a future of the render's result
+        future = self._jobs.get(key)
+        if future is not None :
+            self.duplicates += 1
+            return future
+        future = self.loop.create_future()
+        self._jobs[key] = future
+        self.queue.put_nowait((priority, next(self._sequence), key, render))
+        self.submitted += 1
+        return future
+
+    async def _worker(self) :
+        while True :
+            try :
+                priority, sequence, key, render = self.queue.get_nowait()
+            except asyncio.QueueEmpty :
+                return
+            future = self._jobs[key]
+            try :
+                future.set_result(await render())
+            except Exception as exc :
+                self.failed += 1
+                logging.error('render {} failed: {}'.format(key, exc))
+                future.set_result(None)
+            finally :
+                del self._jobs[key]
+                self.completed += 1
+                step = max(1, self.submitted // 10)
+                if not self.completed % step or self.completed == self.submitted :
+                    logging.info('rendered {}/{} plots ({} failed, {} duplicates skipped)'.format(self.completed, self.submitted, self.failed, self.duplicates))
+
+    def drain(self, timeout=600) :
+        self.loop.run_until_complete(self.adrain(timeout=timeout))
+
+    async def adrain(self, timeout=600) :
+        # run the queued renders to completion
+        if self.queue.empty() :
+            return
+        timer = time.perf_counter()
+        monitor = iperf_flow.get_lag_monitor()
+        monitor.start()
+        try :
+            tasks = [asyncio.ensure_future(self._worker(), loop=self.loop) for index in range(self.concurrency)]
+            done, pending = await asyncio.wait(tasks, timeout=timeout, loop=self.loop)
+        finally :
+            monitor.stop()
+        if pending :
+            for task in pending :
+                task.cancel()
+            logging.error('plot timed out')
+            raise asyncio.TimeoutError()
+        logging.info('render queue drained in {:.3f} seconds'.format(time.perf_counter() - timer))
+        self.submitted = self.completed = self.failed = self.duplicates = 0
+
+class async_writer(object):
+    # Result file I/O off the event loop so plotting can't stall the pipe readers
+    # of live flows.  Writes requested within one loop iteration are batched into
+    # a single job for a small thread pool, each file gets one buffered write
+    # (making its directory if needed).  run() takes any other blocking file
+    # system call, e.g. the plot cache links.
+    def __init__(self, workers=2, loop=None) :
+        self.loop = loop or iperf_flow.loop
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.files = 0
+        self.bytes = 0
+        self.batches = 0
+        self._batch = []
+
+    def write(self, path, data) :
+        # returns a future which is done once path holds data
+        future = self.loop.create_future()
+        if not self._batch :
+            self.loop.call_soon(self._flush)
+        self._batch.append((path, data, future))
+        return future
+
+    def _flush(self) :
+        batch, self._batch = self._batch, []
+        self.batches += 1
+        job = self.loop.run_in_executor(self.executor, async_writer.write_files, [(path, data) for path, data, future in batch])
+        job.add_done_callback(functools.partial(self._written, batch))
+
+    def _written(self, batch, job) :
+        errors = job.exception() or job.result()
+        for index, (path, data, future) in enumerate(batch) :
+            if future.done() :
+                continue
+            error = errors if isinstance(errors, BaseException) else errors[index]
+            if error :
+                future.set_exception(error)
+            else :
+                self.files += 1
+                self.bytes += len(data)
+                future.set_result(path)
+
+    @classmethod
+    def write_files(cls, batch) :
+        # runs in the thread pool, returns an error (or None) per file
+        errors = []
+        for path, data in batch :
+            try :
+                directory = os.path.dirname(path)
+                if directory :
+                    os.makedirs(directory, exist_ok=True)
+                with open(path, 'wb' if isinstance(data, bytes) else 'w', buffering=max(len(data), io.DEFAULT_BUFFER_SIZE)) as fid :
+                    fid.write(data)
+                errors.append(None)
+            except OSError as exc :
+                errors.append(exc)
+        return errors
+
+    @classmethod
+    def same_content(cls, path, data) :
+        if not os.path.exists(path) :
+            return False
+        with open(path, 'r') as fid :
+            return fid.read() == data
+
+    async def run(self, func, *args, **kwargs) :
+        return await self.loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def makedirs(self, directory) :
+        await self.run(os.makedirs, directory, exist_ok=True)
+
+    def close(self) :
+        self.executor.shutdown(wait=True)
+        if self.files :
+            logging.info('async writer wrote {} files ({} bytes) in {} batches'.format(self.files, self.bytes, self.batches))
+
+class loop_lag_monitor(object):
+    # Event loop lag, i.e. how late a periodic timer fires, to confirm ingest
+    # isn't stalled by blocking work (disk, plotting, ...).  Lag is in ms and a
+    # stall is lag beyond stall seconds.  Only measure while the loop is driven,
+    # i.e. between start() and stop(), a stopped loop would read as lag.  Runs
+    # sharing the monitor (concurrent arun()s, a plot drain) each start() and
+    # stop() it, it measures until the last of them stops.
+    def __init__(self, interval=0.05, stall=0.05, loop=None) :
+        self.interval = interval
+        self.stall = stall
+        self.loop = loop or iperf_flow.loop
+        self.lag = running_stats()
+        self.stalls = 0
+        self._task = None
+        self._users = 0
+
+    def start(self) :
+        # returns False if already running
+        self._users += 1
+        if self._task is not None :
+            return False
+        self._task = asyncio.ensure_future(self._monitor(), loop=self.loop)
+        return True
+
+    async def _monitor(self) :
+        while True :
+            expected = self.loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, self.loop.time() - expected)
+            self.lag.update(lag * 1000)
+            if lag > self.stall :
+                self.stalls += 1
+                logging.debug('event loop stalled for {:.1f} ms'.format(lag * 1000))
+
+    def stop(self) :
+        if self._users :
+            self._users -= 1
+        if self._users or self._task is None :
+            return
+        self._task.cancel()
+        if not self.loop.is_running() :
+            self.loop.run_until_complete(asyncio.wait([self._task], loop=self.loop))
+        self._task = None
+        self.report()
+
+    def report(self) :
+        if self.lag.count :
+            logging.info('event loop lag (ms) mean={:.3f} max={:.3f} samples={} stalls(>{} ms)={}'.format(self.lag.mean, self.lag.max, self.lag.count, self.stall * 1000, self.stalls))
+
+class plot_cache(object):
+    # Content addressed store of plot products (.data, .png, ...) keyed by a hash
+    # of what produced them, i.e. the histogram bins and the plot parameters.  A
+    # hit hard links (or copies) the stored files into the output directory so
+    # nothing is regenerated, a miss is rendered then stored.  The store is capped
+    # at capacity bytes by evicting the least recently used files.
+    def __init__(self, directory, capacity=1 << 30) :
+        self.directory = directory
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        # fetch/store run in the async_writer thread pool, the directory is made
+        # there too (by the first store()) rather than on the event loop
+        self._lock = threading.RLock()
+        self._made = False
+
+    @classmethod
+    def key(cls, *parts) :
+        digest = hashlib.sha1()
+        for part in parts :
+            digest.update(part if isinstance(part, bytes) else str(part).encode())
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def path(self, key, suffix) :
+        return os.path.join(self.directory, key + suffix)
+
+    def fetch(self, key, suffixes, basefilename) :
+        # put the stored products of key at basefilename + suffix, False on a miss
+        with self._lock :
+            paths = [self.path(key, suffix) for suffix in suffixes]
+            if not all([os.path.exists(path) for path in paths]) :
+                self.misses += 1
+                return False
+            for path, suffix in zip(paths, suffixes) :
+                destination = basefilename + suffix
+                # bump the access time for the LRU eviction
+                os.utime(path)
+                if os.path.exists(destination) :
+                    if os.path.samefile(path, destination) :
+                        continue
+                    os.remove(destination)
+                try :
+                    os.link(path, destination)
+                except OSError :
+                    shutil.copyfile(path, destination)
+            self.hits += 1
+            return True
+
+    def unlink(self, suffixes, basefilename) :
+        # remove outputs before they're regenerated, they may be links to stored files
+        for suffix in suffixes :
+            if os.path.exists(basefilename + suffix) :
+                os.remove(basefilename + suffix)
+
+    def store(self, key, suffixes, basefilename) :
+        with self._lock :
+            if not self._made :
+                os.makedirs(self.directory, exist_ok=True)
+                self._made = True
+            if self._size is None :
+                self._size = sum([entry.stat().st_size for entry in os.scandir(self.directory) if entry.is_file()])
+            for suffix in suffixes :
+                source = basefilename + suffix
+                if not os.path.exists(source) :
+                    continue
+                path = self.path(key, suffix)
+                if os.path.exists(path) :
+                    os.remove(path)
+                    self._size = None
+                try :
+                    os.link(source, path)
+                except OSError :
+                    shutil.copyfile(source, path)
+                if self._size is not None :
+                    self._size += os.path.getsize(path)
+            if self._size is None or self._size > self.capacity :
+                self.evict()
+
+    def evict(self) :
+        # least recently used first until under 90% of the capacity
+        with self._lock :
+            entries = sorted([entry for entry in os.scandir(self.directory) if entry.is_file()], key=lambda entry : entry.stat().st_atime)
+            self._size = sum([entry.stat().st_size for entry in entries])
+            for entry in entries :
+                if self._size <= 0.9 * self.capacity :
+                    break
+                self._size -= entry.stat().st_size
+                os.remove(entry.path)
+                logging.debug('plot cache evicted {}'.format(entry.name))
+
+class ks_table(object):
+    # Incremental two sample KS table of one flow's histograms of a name.  A row
+    # is added as each final histogram arrives, so only the pairs with the new
+    # run are computed (O(n) per run rather than O(n^2) at the end) and the run is
+    # reported right away as the same as or different from the earlier runs.  D
+    # and p are kept in square matrices grown by doubling, pair results are cached
+    # by histogram uid.
+    # process pool size (None is the cpu count) and pairs per pool task
+    workers = None
+    chunk_pairs = 2048
+    _pool = None
+
+    def __init__(self, name, flowname=None, critical_p=0.01) :
+        self.name = name
+        self.flowname = flowname
+        self.critical_p = critical_p
+        self.histograms = []
+        self._cache = {}
+        self._d = np.zeros((0, 0))
+        self._p = np.ones((0, 0))
+        self._adding = None
+
+    def __len__(self) :
+        return len(self.histograms)
+
+    @classmethod
+    def compute(cls, grids, pairs) :
+        # KS (D, p) of the (row, column) pairs, in chunks across a process pool
+        # unless it's only a chunk
+        if len(pairs) <= cls.chunk_pairs :
+            return ks_pairs(grids, pairs)
+        pool = cls.pool()
+        if pool is None :
+            # an executor thread before the main thread made the pool
+            return ks_pairs(grids, pairs)
+        chunks = [pairs[ix:ix + cls.chunk_pairs] for ix in range(0, len(pairs), cls.chunk_pairs)]
+        return [result for chunk in pool.map(ks_pairs, [grids] * len(chunks), chunks) for result in chunk]
+
+    @classmethod
+    def pool(cls) :
+        # The process pool of every table, made on first use and shut down at exit.
+        # Its workers are forked as it's made, and only from the main thread as a
+        # fork from another thread (e.g. add_later()'s executor) can copy a lock
+        # some other thread holds.  None until the main thread asks for it.  Not
+        # spawn or forkserver, those rerun the scripts, which have no __main__ guard
+        if ks_table._pool is None and threading.current_thread() is threading.main_thread() :
+            ks_table._pool = concurrent.futures.ProcessPoolExecutor(max_workers=cls.workers)
+            ks_table._pool.submit(int).result()
+            atexit.register(ks_table._pool.shutdown)
+        return ks_table._pool
+
+    @classmethod
+    def key(cls, h1, h2) :
+        return (h1.uid, h2.uid) if h1.uid < h2.uid else (h2.uid, h1.uid)
+
+    def _grow(self, n) :
+        capacity = len(self._d)
+        if n <= capacity :
+            return
+        capacity = max(n, 2 * capacity, 16)
+        d = np.zeros((capacity, capacity))
+        p = np.ones((capacity, capacity))
+        size = len(self._d)
+        d[:size, :size] = self._d
+        p[:size, :size] = self._p
+        self._d = d
+        self._p = p
+
+    def add(self, histogram) :
+        return self.update(self.histograms + [histogram])
+
+    def add_later(self, histogram, loop) :
+        # add() from the event loop, i.e. a live flow.  The new row's pairs are
+        # computed in the loop's default executor (compute() still uses its process
+        # pool for many pairs) and the adds are chained to keep the arrival order
+        self._adding = asyncio.ensure_future(self._add(histogram, self._adding, loop), loop=loop)
+        return self._adding
+
+    async def _add(self, histogram, previous, loop) :
+        if previous is not None :
+            await asyncio.wait([previous], loop=loop)
+        if histogram.uid in [h.uid for h in self.histograms] :
+            # already added by an update(), e.g. compute_ks_table()
+            return 0
+        histograms = self.histograms + [histogram]
+        row = len(self.histograms)
+        pairs = [(i, row) for i in range(row) if ks_table.key(histograms[i], histogram) not in self._cache]
+        if len(pairs) > ks_table.chunk_pairs :
+            # from the loop's (main) thread rather than the executor's
+            ks_table.pool()
+        try :
+            if pairs :
+                results = await loop.run_in_executor(None, ks_table.compute, [h.grid for h in histograms], pairs)
+                for (i, j), result in zip(pairs, results) :
+                    self._cache[ks_table.key(histograms[i], histograms[j])] = result
+        except Exception as error :
+            logging.error('KS: {} {} row {} failed: {}'.format(self.flowname, self.name, row, error))
+            return 0
+        if histogram.uid in [h.uid for h in self.histograms] :
+            # an update() ran while the pairs were computed and added it
+            return 0
+        # only the matrix fill is left for update(), the pairs are cached (any
+        # rows an update() added meanwhile compute their missing pairs there)
+        self.update(self.histograms + [histogram])
+        return len(pairs)
+
+    def update(self, histograms, log=True) :
+        # Make the table rows the histograms (in order), returns the number of
+        # pairs that had to be computed.  Rows already present are kept as is
+        previous = len(self.histograms)
+        if [h.uid for h in self.histograms] != [h.uid for h in histograms[:previous]] :
+            previous = 0
+        self._grow(len(histograms))
+        pairs = [(i, j) for j in range(previous, len(histograms)) for i in range(j) if ks_table.key(histograms[i], histograms[j]) not in self._cache]
+        if pairs :
+            grids = [h.grid for h in histograms]
+            for (i, j), result in zip(pairs, ks_table.compute(grids, pairs)) :
+                self._cache[ks_table.key(histograms[i], histograms[j])] = result
+        for j in range(previous, len(histograms)) :
+            histograms[j].ks_index = j
+            self._d[j, j] = 0.0
+            self._p[j, j] = 1.0
+            for i in range(j) :
+                d, p = self._cache[ks_table.key(histograms[i], histograms[j])]
+                self._d[i, j] = self._d[j, i] = d
+                self._p[i, j] = self._p[j, i] = p
+        self.histograms = list(histograms)
+        if log :
+            for index in range(max(previous, 1), len(histograms)) :
+                self.report(index)
+        return len(pairs)
+
+    def different(self, index=-1) :
+        # a run is different when it fails the KS test against every earlier run
+        if index < 0 :
+            index += len(self.histograms)
+        return index > 0 and bool(np.all(self._p[index, :index] <= self.critical_p))
+
+    def report(self, index) :
+        pvalues = self._p[index, :index]
+        resultstr = ''.join(['1' if p > self.critical_p else '0' for p in pvalues])
+        logging.info('KS: {} {}({:3d}):{} minp={} ptest={} {}'.format(self.flowname, self.name, index, resultstr, str(pvalues.min()), str(self.critical_p), 'different' if self.different(index) else 'same'))
+
+    @property
+    def dmatrix(self) :
+        n = len(self.histograms)
+        return self._d[:n, :n]
+
+    @property
+    def pmatrix(self) :
+        n = len(self.histograms)
+        return self._p[:n, :n]
+
+    @property
+    def condensed(self) :
+        # condensed distance matrix (scipy pdist order), i.e. the linkage input
+        import scipy.spatial.distance
+        return scipy.spatial.distance.squareform(self.dmatrix, checks=False)
+
 class flow_histogram(object):
 
     @classmethod
@@ -902,17 +2600,17 @@ class flow_histogram(object):
         mytitle = '{} {} two sample KS({},{}) ({} samples) {}/{}%={}/{} us outliers={}\\n{}'.format(flowname, h1.name, h1.ks_index, h2.ks_index, h2.population, h2.lci, h2.uci, lci_val, uci_val, h2.outliers, title)
         if h1.basefilename is None :
             h1.output_dir = directory + '/' + flowname + h1.name + '/' + h1.name + '_' + str(h1.ks_index)
-            await h1.write(directory=h1.output_dir)
+            await h1.write_once(directory=h1.output_dir)
 
         if h2.basefilename is None :
             h2.output_dir = directory + '/' + flowname + h2.name + '/' + h2.name + '_' + str(h2.ks_index)
-            await h2.write(directory=h2.output_dir)
+            await h2.write_once(directory=h2.output_dir)
 
         if (h1.basefilename is not None) and (h2.basefilename is not None) :
             basefilename = '{}_{}_{}'.format(h1.basefilename, h1.ks_index, h2.ks_index)
             gpcfilename = basefilename + '.gpc'
             #write out the gnuplot control file
-            with open(gpcfilename, 'w') as fid :
+            with io.StringIO() as fid :
                 if outputtype == 'canvas' :
                     fid.write('set output \"{}.{}\"\n'.format(basefilename, 'html'))
                     fid.write('set terminal canvas standalone mousing size 1024,768\n')
@@ -970,23 +2668,99 @@ class flow_histogram(object):
                     fid.write('set xtics add 10\n')
                     fid.write('set format x \"%.0f"\n')
                 fid.write('plot \"{0}\" using 1:2 index 0 axes x1y2 with impulses linetype 3 notitle,  \"{1}\" using 1:2 index 0 axes x1y2 with impulses linetype 2 notitle, \"{1}\" using 1:3 index 0 axes x1y1 with lines linetype 1 linewidth 2 notitle, \"{0}\" using 1:3 index 0 axes x1y1 with lines linetype -1 linewidth 2 notitle\n'.format(h1.datafilename, h2.datafilename))
+                gpc = fid.getvalue()
 
-            childprocess = await asyncio.create_subprocess_exec(flow_histogram.gnuplot,gpcfilename, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, loop=iperf_flow.loop)
-            stdout, stderr = await childprocess.communicate()
-            if stderr :
-                logging.error('Exec {} {}'.format(flow_histogram.gnuplot, gpcfilename))
-            else :
-                logging.debug('Exec {} {}'.format(flow_histogram.gnuplot, gpcfilename))
+            products = ['_svg.html'] if outputtype == 'svg' else ['.png']
+            key = flow_histogram.plot_key('ks', gpc, [basefilename, h1.datafilename, h2.datafilename], h1.digest, h2.digest)
+            await flow_histogram.render(gpcfilename, gpc, basefilename, products, key)
 
     gnuplot = '/usr/bin/gnuplot'
-    def __init__(self, binwidth=None, name=None, values=None, population=None, starttime=None, endtime=None, title=None, outliers=None, lci = None, uci = None, lci_val = None, uci_val = None) :
-        self.raw = values
+    # number of gnuplot processes in the pool and seconds a render may take
+    gnuplot_workers = 4
+    gnuplot_timeout = 60
+    pool = None
+
+    scheduler = None
+
+    @classmethod
+    def get_scheduler(cls) :
+        if flow_histogram.scheduler is None :
+            flow_histogram.scheduler = render_scheduler(concurrency=flow_histogram.gnuplot_workers)
+        return flow_histogram.scheduler
+
+    # The plot cache is opt in, set plot_cache_directory (e.g. ~/.cache/flows) to
+    # reuse plots across runs.  The store evicts least recently used files to stay
+    # under plot_cache_size bytes (1 GB), so budget that much disk for it.
+    plot_cache_directory = None
+    plot_cache_size = 1 << 30
+    cache = None
+
+    @classmethod
+    def get_plot_cache(cls) :
+        if flow_histogram.cache is None and flow_histogram.plot_cache_directory :
+            flow_histogram.cache = plot_cache(flow_histogram.plot_cache_directory, capacity=flow_histogram.plot_cache_size)
+        return flow_histogram.cache
+
+    @classmethod
+    def plot_key(cls, kind, gpc, paths, *digests) :
+        # the plot cache key of a control file, the output and data paths don't
+        # change the plot so aren't part of the key
+        for path in paths :
+            gpc = gpc.replace(path, '')
+        return plot_cache.key(kind, gpc, *digests)
+
+    @classmethod
+    async def render(cls, gpcfilename, gpc, basefilename, products, key) :
+        # Write the control file and render it unless the plot cache has the
+        # products for key
+        cache = flow_histogram.get_plot_cache()
+        writer = iperf_flow.get_writer()
+        if cache and await writer.run(cache.fetch, key, products, basefilename) :
+            logging.debug('plot cache hit {}'.format(basefilename))
+            if not await writer.run(async_writer.same_content, gpcfilename, gpc) :
+                await writer.write(gpcfilename, gpc)
+            return
+        await writer.write(gpcfilename, gpc)
+        if cache :
+            # outputs may be links into the store, don't let gnuplot write through them
+            await writer.run(cache.unlink, products, basefilename)
+        await flow_histogram.get_gnuplot_pool().render(gpcfilename)
+        if cache :
+            await writer.run(cache.store, key, products, basefilename)
+
+    @property
+    def digest(self) :
+        # hash of the histogram's content, i.e. what its .data file is made of
+        return plot_cache.key(self.binwidth, self.population, self.values.astype(np.int64).tobytes(), self.counts.astype(np.float64).tobytes())
+
+    @classmethod
+    def get_gnuplot_pool(cls) :
+        if flow_histogram.pool is None :
+            flow_histogram.pool = gnuplot_pool(size=flow_histogram.gnuplot_workers, gnuplot=flow_histogram.gnuplot, timeout=flow_histogram.gnuplot_timeout)
+        return flow_histogram.pool
+
+    uids = itertools.count()
+    def __init__(self, binwidth=None, name=None, values=None, population=None, starttime=None, endtime=None, title=None, outliers=None, lci = None, uci = None, lci_val = None, uci_val = None, counts=None) :
+        self.uid = next(flow_histogram.uids)
         self._entropy = None
-        self.bins = self.raw.split(',')
+        self._samples = None
+        self._cumulative = None
+        self._written = None
+        if counts is None :
+            # the PDF bins parsed once, ex. '223:1,240:1,241:1' -> values [223 240 241] counts [1 1 1]
+            self.raw = values
+            bins = np.array(self.raw.replace(':', ',').split(','), dtype=np.int64).reshape(-1, 2)
+            self.values = bins[:, 0]
+            self.counts = bins[:, 1]
+            self.population = int(population)
+        else :
+            # already binned, e.g. a merge, where weighted counts (and population) may be fractional
+            self.raw = None
+            self.values = np.asarray(values)
+            self.counts = np.asarray(counts)
+            self.population = population
         self.name = name
         self.ks_index = None
-        self.population = int(population)
-        self.samples = np.zeros(int(self.population))
         self.binwidth = int(binwidth)
         self.createtime = datetime.now(timezone.utc).astimezone()
         self.starttime=starttime
@@ -998,21 +2772,104 @@ class flow_histogram(object):
         self.lci = lci
         self.lci_val = lci_val
         self.basefilename = None
-        ix = 0
-        for bin in self.bins :
-            x,y = bin.split(':')
-            for i in range(int(y)) :
-                self.samples[ix] = x
-                ix += 1
+
+    @property
+    def bins(self) :
+        if self.raw is None :
+            self.raw = ','.join(['{}:{}'.format(x, y) for x, y in zip(self.values.tolist(), self.counts.tolist())])
+        return self.raw.split(',')
+
+    @classmethod
+    def merge(cls, histograms, name=None, weights=None, starttime=None, endtime=None, title=None) :
+        # Aggregate histograms (e.g. runs of a campaign or a group of flows) into a
+        # new histogram by summing counts per bin, so the result is O(bins) no matter
+        # the packet count.  The bin widths must match.  weights scale each
+        # histogram's counts, population and outliers.  starttime/endtime merge only
+        # the histograms that ended within that window.
+        histograms = [h for h in histograms if (starttime is None or (h.endtime is not None and h.endtime >= starttime)) and (endtime is None or (h.endtime is not None and h.endtime < endtime))]
+        if not histograms :
+            raise ValueError('no histograms to merge')
+        binwidth = histograms[0].binwidth
+        if any([h.binwidth != binwidth for h in histograms]) :
+            raise ValueError('histogram bin widths differ {}'.format(sorted(set([h.binwidth for h in histograms]))))
+        if weights is None :
+            weights = [1] * len(histograms)
+        elif len(weights) != len(histograms) :
+            raise ValueError('{} weights for {} histograms'.format(len(weights), len(histograms)))
+        values, inverse = np.unique(np.concatenate([h.values for h in histograms]), return_inverse=True)
+        counts = np.bincount(inverse, weights=np.concatenate([h.counts * w for h, w in zip(histograms, weights)]), minlength=len(values))
+        population = sum([h.population * w for h, w in zip(histograms, weights)])
+        outliers = sum([int(h.outliers or 0) * w for h, w in zip(histograms, weights)])
+        if all([float(w).is_integer() for w in weights]) :
+            counts = counts.astype(np.int64)
+            population = int(population)
+            outliers = int(outliers)
+        starttimes = [h.starttime for h in histograms if h.starttime is not None]
+        endtimes = [h.endtime for h in histograms if h.endtime is not None]
+        merged = cls(name=name or histograms[0].name, values=values, counts=counts, population=population, binwidth=binwidth, outliers=outliers, title=title, starttime=min(starttimes) if starttimes else None, endtime=max(endtimes) if endtimes else None)
+        # confidence interval bins from the merged distribution
+        lci, uci = histograms[0].lci, histograms[0].uci
+        if lci is not None and uci is not None :
+            merged.lci, merged.uci = lci, uci
+            merged.lci_val = str(merged.values[merged._bin_index(float(lci) / 100)])
+            merged.uci_val = str(merged.values[merged._bin_index(float(uci) / 100)])
+        return merged
+
+    def __add__(self, other) :
+        return flow_histogram.merge([self, other])
+
+    @property
+    def samples(self) :
+        # expanded (one value per sample) only on demand, bin level stats use values/counts
+        if self._samples is None :
+            self._samples = np.repeat(self.values, np.rint(self.counts).astype(np.int64)).astype(np.float64)
+        return self._samples
+
+    @classmethod
+    def ks_2samp(cls, h1, h2) :
+        # Two sample KS from the cumulative bin counts, i.e. O(bins) rather than
+        # O(population log population) on expanded samples.  D is exact (the ECDFs
+        # only step at bin values) and p is the asymptotic Kolmogorov distribution
+        # with Stephens' correction for the effective sample size
+        return ks_2samp_binned(*(h1.grid + h2.grid))
+
+    @property
+    def grid(self) :
+        # bin values in us and their counts
+        return (self.values * self.binwidth, self.counts)
+
+    @property
+    def cumulative(self) :
+        # cumulative counts, the index for the quantile, cdf and tail queries
+        if self._cumulative is None :
+            self._cumulative = np.cumsum(self.counts)
+        return self._cumulative
+
+    def _bin_index(self, q, side='left') :
+        # the first bin whose cumulative count reaches (or, side='right', exceeds) q of the population
+        index = np.searchsorted(self.cumulative, np.asarray(q, dtype=np.float64) * self.population, side=side)
+        return np.minimum(index, len(self.counts) - 1)
+
+    def quantile(self, q) :
+        # value (ms) at quantile q, e.g. 0.5, 0.99 or a list of them which returns an array
+        value = self.values[self._bin_index(q)] * self.binwidth / 1000.0
+        return value if np.ndim(value) else float(value)
+
+    def cdf(self, value) :
+        # fraction of the samples <= value (ms), a list of values returns an array
+        index = np.searchsorted(self.values * self.binwidth / 1000.0, np.asarray(value, dtype=np.float64), side='right')
+        fraction = np.where(index > 0, self.cumulative[np.maximum(index - 1, 0)], 0) / float(self.population)
+        return fraction if np.ndim(fraction) else float(fraction)
+
+    def tail_mass(self, threshold) :
+        # fraction of the samples > threshold (ms)
+        return 1.0 - self.cdf(threshold)
 
     @property
     def entropy(self) :
         if not self._entropy :
-            self._entropy = 0
-            for bin in self.bins :
-                x,y = bin.split(':')
-                y1 = float(y) / float(self.population)
-                self._entropy -= y1 * math.log2(y1)
+            p = self.counts[self.counts > 0] / float(self.population)
+            self._entropy = float(-np.sum(p * np.log2(p)))
         return self._entropy
 
     @property
@@ -1023,39 +2880,42 @@ class flow_histogram(object):
     def ampdu_dump(self, value):
         self._ampdu_rawdump = value
 
-    async def __exec_gnuplot(self) :
+    async def __exec_gnuplot(self, gpc, outputtype='png') :
         logging.info('Plotting {} {}'.format(self.name, self.gpcfilename))
-        childprocess = await asyncio.create_subprocess_exec(flow_histogram.gnuplot, self.gpcfilename, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, loop=iperf_flow.loop)
-        stdout, stderr = await childprocess.communicate()
-        if stderr :
-            logging.error('Exec {} {}'.format(flow_histogram.gnuplot, self.gpcfilename))
-        else  :
-            logging.debug('Exec {} {}'.format(flow_histogram.gnuplot, self.gpcfilename))
+        if outputtype == 'svg' :
+            products = ['_svg.html']
+        else :
+            products = ['.png', '_thumb.png'] if outputtype == 'png' else ['.png']
+        key = flow_histogram.plot_key('histogram', gpc, [self.basefilename, self.datafilename], self.digest)
+        await flow_histogram.render(self.gpcfilename, gpc, self.basefilename, products, key)
 
     async def write(self, directory='.', filename=None) :
         # write out the datafiles for the plotting tool,  e.g. gnuplot
         if filename is None:
             filename = self.name
 
-        if not os.path.exists(directory):
-            logging.debug('Making results directory {}'.format(directory))
-            os.makedirs(directory)
+        writer = iperf_flow.get_writer()
+        await writer.makedirs(directory)
 
         logging.debug('Writing {} results to directory {}'.format(directory, filename))
         basefilename = os.path.join(directory, filename)
         datafilename = os.path.join(directory, filename + '.data')
         self.max  = None
-        with open(datafilename, 'w') as fid :
-            cummulative = 0
-            for bin in self.bins :
-                x,y = bin.split(':')
-                #logging.debug('bin={} x={} y={}'.format(bin, x, y))
-                cummulative += float(y)
-                perc = cummulative / float(self.population)
-                if not self.max and (perc > 0.98) :
-                    self.max = float(x) * float(self.binwidth) / 1000.0
-                    logging.debug('98% max = {}'.format(self.max))
-                fid.write('{} {} {}\n'.format((float(x) * float(self.binwidth) / 1000.0), int(y), perc))
+        x = self.values * float(self.binwidth) / 1000.0
+        perc = self.cumulative / float(self.population)
+        index = int(self._bin_index(0.98, side='right'))
+        if not x[index] and index + 1 < len(x) :
+            index += 1
+        if perc[index] > 0.98 and x[index] :
+            self.max = float(x[index])
+            logging.debug('98% max = {}'.format(self.max))
+        cache = flow_histogram.get_plot_cache()
+        if not (cache and await writer.run(cache.fetch, self.digest, ['.data'], basefilename)) :
+            if cache :
+                await writer.run(cache.unlink, ['.data'], basefilename)
+            await writer.write(datafilename, ''.join(['{} {} {}\n'.format(*row) for row in zip(x.tolist(), self.counts.tolist(), perc.tolist())]))
+            if cache :
+                await writer.run(cache.store, self.digest, ['.data'], basefilename)
 
         if self.max :
             self.basefilename = basefilename
@@ -1063,6 +2923,12 @@ class flow_histogram(object):
         else :
             self.basefilename = None
 
+    async def write_once(self, directory='.', filename=None) :
+        # write() shared by concurrent renders of this histogram, e.g. the KS pairs it's in
+        if self._written is None :
+            self._written = asyncio.ensure_future(self.write(directory=directory, filename=filename), loop=iperf_flow.loop)
+        await self._written
+
     async def async_plot(self, title=None, directory='.', outputtype='png', filename=None) :
         if self.basefilename is None :
             await self.write(directory=directory, filename=filename)
@@ -1070,15 +2936,15 @@ class flow_histogram(object):
         if self.basefilename is not None :
             self.gpcfilename = self.basefilename + '.gpc'
             #write out the gnuplot control file
-            with open(self.gpcfilename, 'w') as fid :
+            with io.StringIO() as fid :
                 if outputtype == 'canvas' :
-                    fid.write('set output \"{}.{}\"\n'.format(basefilename, 'html'))
+                    fid.write('set output \"{}.{}\"\n'.format(self.basefilename, 'html'))
                     fid.write('set terminal canvas standalone mousing size 1024,768\n')
                 if outputtype == 'svg' :
-                    fid.write('set output \"{}_svg.{}\"\n'.format(basefilename, 'html'))
+                    fid.write('set output \"{}_svg.{}\"\n'.format(self.basefilename, 'html'))
                     fid.write('set terminal svg size 1024,768 dynamic mouse\n')
                 else :
-                    fid.write('set output \"{}.{}\"\n'.format(basefilename, 'png'))
+                    fid.write('set output \"{}.{}\"\n'.format(self.basefilename, 'png'))
                     fid.write('set terminal png size 1024,768\n')
 
                 if not title and self.title :
@@ -1118,13 +2984,235 @@ class flow_histogram(object):
                 else :
                     fid.write('set xrange [0:100]\n')
                     fid.write('set xtics add 10\n')
-                fid.write('plot \"{0}\" using 1:2 index 0 axes x1y2 with impulses linetype 3 notitle, \"{0}\" using 1:3 index 0 axes x1y1 with lines linetype -1 linewidth 2 notitle\n'.format(datafilename))
+                fid.write('plot \"{0}\" using 1:2 index 0 axes x1y2 with impulses linetype 3 notitle, \"{0}\" using 1:3 index 0 axes x1y1 with lines linetype -1 linewidth 2 notitle\n'.format(self.datafilename))
 
                 if outputtype == 'png' :
                     # Create a thumbnail too
                     fid.write('unset output; unset xtics; unset ytics; unset key; unset xlabel; unset ylabel; unset border; unset grid; unset yzeroaxis; unset xzeroaxis; unset title; set lmargin 0; set rmargin 0; set tmargin 0; set bmargin 0\n')
-                    fid.write('set output \"{}_thumb.{}\"\n'.format(basefilename, 'png'))
+                    fid.write('set output \"{}_thumb.{}\"\n'.format(self.basefilename, 'png'))
                     fid.write('set terminal png transparent size 64,32 crop\n')
-                    fid.write('plot \"{0}\" using 1:2 index 0 axes x1y2 with impulses linetype 3 notitle, \"{0}\" using 1:3 index 0 axes x1y1 with lines linetype -1 linewidth 2 notitle\n'.format(datafilename))
+                    fid.write('plot \"{0}\" using 1:2 index 0 axes x1y2 with impulses linetype 3 notitle, \"{0}\" using 1:3 index 0 axes x1y1 with lines linetype -1 linewidth 2 notitle\n'.format(self.datafilename))
+                gpc = fid.getvalue()
+
+            await self.__exec_gnuplot(gpc, outputtype)
+
+class flow_replay(object):
+    # Rebuild flowstats and flow_histograms offline, i.e. without traffic or an
+    # event loop, from a saved test.log or from raw captured iperf stdout.  The
+    # file is memory mapped and its lines are fed through the same protocol
+    # line_received() parsers used for live flows, except for the (TCP) interval
+    # traffic lines of a test.log, which are most of any log.  Those are pulled
+    # out with findall() and added as arrays (traffic_received()), in order
+    # with the other lines of their flow.  A parallel (-P) flow's traffic lines
+    # are per stream so they go through line_received() too.
+    #
+    # ex. 2018-10-30 10:01:02,123 INFO     flows      [Mouse(tcp)->RX(10.19.87.7)] [  4] 0.00-0.50 sec  657090 Bytes ... (stdout,2565)
+    regex_logline = re.compile(rb'^(?P<prefix>[^\n\[]*)\[(?P<flow>[^\n]+?)->(?P<side>RX|TX)\([^)\n]*\)\] (?P<line>[^\n]*) \(stdout,[^)\n]*\)\r?$', re.M)
+    regex_asctime = re.compile(rb'(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d):(\d\d),(\d{3})')
+    # The ')] ' ending the tag of every log line, found with a literal search.  Control lines
+    # are those not followed by an interval report, i.e. open, local, histogram lines, etc.
+    regex_control = re.compile(rb'\)\] (?!\[ *\d+\] +[0-9.]+-[0-9.]+ sec +\d+ Bytes)')
+    # FLOW is the escaped name of one flow, i.e. again a literal search per flow
+    pattern_txtraffic = rb'\[FLOW->TX\([^)\n]*\)\] \[\s*\d+\] \s*([0-9.]+)-([0-9.]+) sec\s+(\d+) Bytes\s+(\d+) bits/sec\s+(\d+)/(\d+)\s+(\d+)\s+(\d+)K/(\d+) us'
+    pattern_rxtraffic = rb'\[FLOW->RX\([^)\n]*\)\] \[\s*\d+\] \s*([0-9.]+)-([0-9.]+) sec\s+(\d+) Bytes\s+(\d+) bits/sec\s+(\d+)'
+    # the (side, line) of the traffic lines, i.e. those regex_control skips
+    pattern_trafficline = rb'\[FLOW->(RX|TX)\([^)\n]*\)\] (\[ *\d+\] +[0-9.]+-[0-9.]+ sec +\d+ Bytes[^\n]*?) \(stdout,[^)\n]*\)\r?$'
+    # bytes of log per findall(), bounds the memory of the matches
+    traffic_chunk = 1 << 24
+
+    def __init__(self, interval=0.5, reset_on_open=False, csv=False, parallel=None) :
+        # interval is the iperf -i used for the captured flows, reset_on_open does a stats_reset()
+        # at every client start, i.e. keeps only the last run like scripts that reset per run,
+        # csv is for output captured from flows run with csv=True (-y C), parallel is the
+        # client's -P of every run, None tells it from the client's connections (local
+        # lines) of each run, which CSV doesn't have
+        self.interval = interval
+        self.csv = csv
+        self.reset_on_open = reset_on_open
+        self.parallel = parallel
+        self.flows = collections.OrderedDict()
+        self.lines = 0
+        self._protocols = {}
+        self._traffic_patterns = {}
+        # flow name -> the local lines of its client's run
+        self._connections = {}
+        self._logger = logging.getLogger(__name__ + '.replay')
+
+    def flow(self, name) :
+        flow = self.flows.get(name)
+        if flow is None :
+            flow = iperf_flow(name=name, interval=self.interval, csv=self.csv)
+            # not a live flow, keep it out of iperf_flow.run(flows='all')
+            flow.destroy()
+            # don't log the replayed lines a second time
+            flow.rx.adapter = flow.rx.CustomAdapter(self._logger, {'connid': flow.rx.name})
+            flow.tx.adapter = flow.tx.CustomAdapter(self._logger, {'connid': flow.tx.name})
+            flow.tx.parallel = flow.rx.parallel = self.parallel if self.parallel and self.parallel > 1 else None
+            self._logger.setLevel(logging.WARNING)
+            self.flows[name] = flow
+        return flow
 
-            await self.__exec_gnuplot()
+    @classmethod
+    def logtime(cls, prefix) :
+        # logging asctime, ex. 2018-10-30 10:01:02,123
+        m = flow_replay.regex_asctime.search(prefix)
+        if m :
+            values = [int(value) for value in m.groups()]
+            values[-1] *= 1000
+            return datetime(*values)
+        return None
+
+    def line_received(self, name, side, line, prefix=None) :
+        # prefix is the log text ahead of the line, it has the time the line was logged
+        flow = self.flow(name)
+        if side == 'RX' :
+            endpoint, classifier = flow.rx, iperf_server_classifier
+        else :
+            endpoint, classifier = flow.tx, iperf_client_classifier
+        key = (name, side)
+        opened = False
+        if line[:len(classifier.open_prefix)] == classifier.open_prefix :
+            kind, m = classifier.classify(line)
+            if kind == iperf_line_classifier.OPEN :
+                # same as a start(), i.e. a new process with a fresh protocol
+                opened = True
+                flow.proto = m.group('proto').decode()
+                flow.dstport = int(m.group('port'))
+                if self.reset_on_open and side == 'TX' :
+                    flow.stats_reset()
+                endpoint.opened.clear()
+                self._protocols.pop(key, None)
+                if side == 'TX' :
+                    self.run_opened(flow)
+        connections = None
+        if side == 'TX' and self.parallel is None and b'] local ' in line :
+            connections = self._connections.setdefault(name, [])
+            connections.append(line)
+            if len(connections) > 1 :
+                flow.tx.parallel = flow.rx.parallel = len(connections)
+        protocol = self._protocols.get(key)
+        if protocol is None :
+            if side == 'RX' :
+                protocol = endpoint.IperfServerProtocol(endpoint, flow)
+            else :
+                protocol = endpoint.IperfClientProtocol(endpoint, flow)
+            self._protocols[key] = protocol
+        histograms = len(flow.flowstats['histograms'])
+        protocol.line_received(line)
+        self.lines += 1
+        if connections and len(connections) == 2 :
+            # the first stream was taken for a single one, give it its own flowid too
+            kind, m = classifier.classify(connections[0])
+            if kind == iperf_line_classifier.LOCAL :
+                protocol.set_stream_flowid(m)
+        if prefix and (opened or len(flow.flowstats['histograms']) > histograms) :
+            # use the time the line was logged rather than the time of the replay
+            timestamp = flow_replay.logtime(prefix)
+        else :
+            timestamp = None
+        if timestamp :
+            if opened and side == 'TX' :
+                flow.flowstats['starttime'] = timestamp
+            if len(flow.flowstats['histograms']) > histograms :
+                flow.flowstats['endtime'] = timestamp
+                for histogram in flow.flowstats['histograms'][histograms:] :
+                    histogram.starttime = flow.flowstats['starttime']
+                    histogram.endtime = timestamp
+
+    def run_opened(self, flow) :
+        # a client start, i.e. a new run, as launch() and start() do of its -P
+        flow.flush_stream_sums()
+        flow.flowstats['streams'] = {}
+        flow.flowstats['rxstreams'] = {}
+        self._connections.pop(flow.name, None)
+        flow.tx.parallel = flow.rx.parallel = self.parallel if self.parallel and self.parallel > 1 else None
+
+    def traffic_received(self, name, side, rows) :
+        # findall() rows of pattern_txtraffic or pattern_rxtraffic, i.e. (start, end, values...)
+        flow = self.flow(name)
+        if side == 'RX' :
+            endpoint, classifier, direction = flow.rx, iperf_server_classifier, 'rx'
+        else :
+            endpoint, classifier, direction = flow.tx, iperf_client_classifier, 'tx'
+        # the same lines the protocols take, see line_received() of IperfServerProtocol and IperfClientProtocol
+        if not endpoint.opened.is_set() or flow.proto != 'TCP' :
+            return
+        if not endpoint.traffic_event.is_set() :
+            endpoint.traffic_event.set()
+        rows = np.array(rows)
+        classifier.hits[iperf_line_classifier.TRAFFIC] += len(rows)
+        self.lines += len(rows)
+        values = [rows[:, column].astype(np.int64) for column in range(2, rows.shape[1])]
+        flow.add_samples(direction, rows[:, 0].astype(np.float64), rows[:, 1].astype(np.float64), *values)
+
+    def _traffic(self, mm, name, start, end) :
+        # the traffic lines of flow name from start to end of the log
+        patterns = self._traffic_patterns.get(name)
+        if patterns is None :
+            flow = re.escape(name.encode())
+            patterns = ([('TX', re.compile(flow_replay.pattern_txtraffic.replace(b'FLOW', flow))),
+                         ('RX', re.compile(flow_replay.pattern_rxtraffic.replace(b'FLOW', flow)))],
+                        re.compile(flow_replay.pattern_trafficline.replace(b'FLOW', flow), re.M))
+            self._traffic_patterns[name] = patterns
+        parallel = self.flow(name).tx.parallel
+        while start < end :
+            stop = end
+            if stop - start > flow_replay.traffic_chunk :
+                stop = mm.rfind(b'\n', start, start + flow_replay.traffic_chunk) + 1
+                if stop <= start :
+                    stop = end
+            if parallel :
+                # each stream to its own record, see add_stream_sample()
+                for side, line in patterns[1].findall(mm, start, stop) :
+                    self.line_received(name, side.decode(), line)
+            else :
+                for side, pattern in patterns[0] :
+                    rows = pattern.findall(mm, start, stop)
+                    if rows :
+                        self.traffic_received(name, side, rows)
+            start = stop
+
+    def load_log(self, filename, flows=None) :
+        # Replay every flow found in a test.log, or only the named flows.  A flow's
+        # traffic lines are replayed ahead of each of its control lines, i.e. in order
+        with open(filename, 'rb') as fid :
+            if not os.fstat(fid.fileno()).st_size :
+                return self.flows
+            with mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ) as mm :
+                # where the traffic of each flow was replayed up to
+                replayed = collections.OrderedDict()
+                nextline = 0
+                for tag in flow_replay.regex_control.finditer(mm) :
+                    if tag.start() < nextline :
+                        # a ')] ' later in a line already replayed
+                        continue
+                    m = flow_replay.regex_logline.match(mm, mm.rfind(b'\n', 0, tag.start()) + 1)
+                    nextline = mm.find(b'\n', tag.start()) + 1 or len(mm)
+                    if not m :
+                        continue
+                    name = m.group('flow').decode()
+                    if flows and name not in flows :
+                        continue
+                    if not self.csv :
+                        self._traffic(mm, name, replayed.get(name, 0), m.start())
+                        replayed[name] = m.end()
+                    self.line_received(name, m.group('side').decode(), m.group('line'), prefix=m.group('prefix'))
+                for name, position in replayed.items() :
+                    self._traffic(mm, name, position, len(mm))
+        for flow in self.flows.values() :
+            flow.flush_stream_sums()
+        logging.info('replayed {} lines of {} for flows {}'.format(self.lines, filename, list(self.flows.keys())))
+        return self.flows
+
+    def load_raw(self, filename, name='iperf', side='RX') :
+        # Replay the raw stdout of one iperf server (side='RX') or client (side='TX')
+        with open(filename, 'rb') as fid :
+            if not os.fstat(fid.fileno()).st_size :
+                return self.flows
+            with mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ) as mm :
+                for line in iter(mm.readline, b'') :
+                    self.line_received(name, side, line.rstrip(b'\r\n'))
+        for flow in self.flows.values() :
+            flow.flush_stream_sums()
+        logging.info('replayed {} lines of {} as {}({})'.format(self.lines, filename, name, side))
+        return self.flows
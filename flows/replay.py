@@ -0,0 +1,72 @@
+#!/usr/bin/env python3.5
+#
+# ---------------------------------------------------------------
+# * Copyright (c) 2018
+# * Broadcom Corporation
+# * All Rights Reserved.
+# *---------------------------------------------------------------
+# Redistribution and use in source and binary forms, with or without modification, are permitted
+# provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this list of conditions
+# and the following disclaimer.  Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the documentation and/or other
+# materials provided with the distribution.  Neither the name of the Broadcom nor the names of
+# contributors may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Author Robert J. McMahon, Broadcom LTD
+#
+# Rebuild flow stats and histograms from a saved test.log (or raw iperf stdout)
+# without running any traffic, e.g. to iterate on analysis code offline
+#
+# Date October 2026
+import logging
+import argparse
+import os, sys
+import time
+
+from flows import *
+
+parser = argparse.ArgumentParser(description='Replay saved iperf output through the flow parsers')
+parser.add_argument('-f','--file', type=str, required=True, help='test.log or raw iperf stdout to replay')
+parser.add_argument('-i','--interval', type=float, required=False, default=0.5, help='iperf report interval used by the flows')
+parser.add_argument('--raw', type=str, required=False, default=None, help='replay raw iperf stdout of a server (RX) or client (TX)')
+parser.add_argument('--name', type=str, required=False, default='iperf', help='flow name for raw replay')
+parser.add_argument('--csv', dest='csv', action='store_true', help='the output is iperf CSV (-y C) reports')
+parser.add_argument('-P','--parallel', type=int, required=False, default=None, help='client parallel (-P) streams of the flows, default told from the log (needed for CSV)')
+parser.add_argument('--flows', type=str, required=False, default=None, help='comma separated flow names to replay, default all')
+parser.add_argument('--ks', dest='ks', action='store_true', help='compute the KS tables of the replayed histograms')
+parser.add_argument('-T','--title', type=str, default="replay", required=False, help='title for graphs')
+parser.add_argument('-o','--output_directory', type=str, required=False, default='./replay', help='output directory')
+parser.set_defaults(ks=False)
+args = parser.parse_args()
+
+if not os.path.exists(args.output_directory):
+    print('Making log directory {}'.format(args.output_directory))
+    os.makedirs(args.output_directory)
+logging.basicConfig(filename=os.path.join(args.output_directory, 'replay.log'), level=logging.INFO, format='%(asctime)s %(name)s %(module)s %(levelname)-8s %(message)s')
+
+replay = flow_replay(interval=args.interval, csv=args.csv, parallel=args.parallel)
+start = time.perf_counter()
+if args.raw :
+    flows = replay.load_raw(args.file, name=args.name, side=args.raw.upper())
+else :
+    flows = replay.load_log(args.file, flows=(args.flows.split(',') if args.flows else None))
+print('Replayed {} lines in {:.3f} sec'.format(replay.lines, time.perf_counter() - start))
+
+for name, flow in flows.items() :
+    print('{} proto={} flowid={} tx samples={} rx samples={} histograms={} ({})'.format(name, flow.proto, flow.flowid, len(flow.flowstats['txsamples']), len(flow.flowstats['rxsamples']), len(flow.histograms), ','.join(sorted(flow.histogram_names))))
+    if args.ks and flow.histograms :
+        flow.compute_ks_table(directory=args.output_directory, title=args.title)
+
+logging.shutdown()
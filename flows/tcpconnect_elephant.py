@@ -34,7 +34,8 @@ import time, datetime
 import os,sys
 import ssh_nodes
 import numpy as np
-import tkinter
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 
 from flows import *
@@ -63,6 +64,7 @@ parser.add_argument('--nocompete', dest='nocompete', action='store_true')
 parser.add_argument('--local', dest='local', action='store_true')
 parser.add_argument('--bidir', dest='bidir', action='store_true')
 parser.add_argument('--frameburst', dest='frameburst', action='store_true')
+parser.add_argument('--plot_cache', type=str, default=None, required=False, help='directory to cache plots across runs in, up to 1 GB (off by default)')
 parser.set_defaults(stacktest=False)
 parser.set_defaults(edca_vi=False)
 parser.set_defaults(nocompete=False)
@@ -138,6 +140,7 @@ logging.getLogger('asyncio').setLevel(logging.DEBUG)
 root = logging.getLogger(__name__)
 loop = asyncio.get_event_loop()
 loop.set_debug(False)
+flow_histogram.plot_cache_directory = args.plot_cache
 
 #instatiate devices for control using control network, also list the wifi dev
 duta = ssh_node(name='SoftAP', ipaddr=args.server, device='ap0', devip='192.168.1.1')
@@ -150,23 +153,23 @@ dut_observe = dutb
 duts = [ap, dut_observe]
 
 #instatiate traffic flows to be used by the test
-mouse = iperf_flow(name="Mouse(tcp)", user='root', server=ap, client=dut_observe, dstip=args.dst, proto='TCP', interval=1, flowtime=args.time, tos=args.tos, debug=False)
+mouse = iperf_flow(name="Mouse(tcp)", user='root', server=ap, client=dut_observe, dstip=args.dst, proto='TCP', interval=1, flowtime=args.time, tos=args.tos, debug=False, persistent=True)
 if not args.nocompete :
     dut_obstruct = [dutc, dutd]
     duts.extend(dut_obstruct)
     if args.stacktest :
-        elephant1 = iperf_flow(name="Elephant1(tcp)", user='root', server=ap, client=dut_observe, dstip=ap.devip, proto='TCP', interval=1, flowtime=7200, tos="BE", window='4M')
-        elephant2 = iperf_flow(name="Elephant2(tcp)", user='root', server=ap, client=dut_observe, dstip=ap.devip, proto='TCP', interval=1, flowtime=7200, tos="BE", window='4M')
+        elephant1 = iperf_flow(name="Elephant1(tcp)", user='root', server=ap, client=dut_observe, dstip=ap.devip, proto='TCP', interval=1, flowtime=7200, tos="BE", window='4M', retention=600)
+        elephant2 = iperf_flow(name="Elephant2(tcp)", user='root', server=ap, client=dut_observe, dstip=ap.devip, proto='TCP', interval=1, flowtime=7200, tos="BE", window='4M', retention=600)
     elif args.local :
-        elephant1 = iperf_flow(name="Elephant1(tcp)", user='root', server=dutd, client=dutc, dstip=dutd.devip, proto='TCP', interval=1, flowtime=7200, tos="BE", window='4M')
-        elephant2 = iperf_flow(name="Elephant2(tcp)", user='root', server=dutc, client=dutd, dstip=dutc.devip, proto='TCP', interval=1, flowtime=7200, tos="BE", window='4M')
+        elephant1 = iperf_flow(name="Elephant1(tcp)", user='root', server=dutd, client=dutc, dstip=dutd.devip, proto='TCP', interval=1, flowtime=7200, tos="BE", window='4M', retention=600)
+        elephant2 = iperf_flow(name="Elephant2(tcp)", user='root', server=dutc, client=dutd, dstip=dutc.devip, proto='TCP', interval=1, flowtime=7200, tos="BE", window='4M', retention=600)
     else :
-        elephant1 = iperf_flow(name="Elephant1(tcp)", user='root', server=ap, client=dut_obstruct[0], dstip=ap.devip, proto='TCP', interval=1, flowtime=7200, tos="BE", window='4M')
-        elephant2 = iperf_flow(name="Elephant2(tcp)", user='root', server=ap, client=dut_obstruct[1], dstip=ap.devip, proto='TCP', interval=1, flowtime=7200, tos="BE", window='4M')
+        elephant1 = iperf_flow(name="Elephant1(tcp)", user='root', server=ap, client=dut_obstruct[0], dstip=ap.devip, proto='TCP', interval=1, flowtime=7200, tos="BE", window='4M', retention=600)
+        elephant2 = iperf_flow(name="Elephant2(tcp)", user='root', server=ap, client=dut_obstruct[1], dstip=ap.devip, proto='TCP', interval=1, flowtime=7200, tos="BE", window='4M', retention=600)
     elephants=[elephant1, elephant2]
     if args.bidir :
-        elephant3 = iperf_flow(name="Elephant3(tcp)", user='root', server=dutc, client=dutd, dstip=dutc.devip, proto='TCP', interval=1, flowtime=7200, tos="BE", window='4M')
-        elephant4 = iperf_flow(name="Elephant4(tcp)", user='root', server=dutd, client=dutc, dstip=dutd.devip, proto='TCP', interval=1, flowtime=7200, tos="BE", window='4M')
+        elephant3 = iperf_flow(name="Elephant3(tcp)", user='root', server=dutc, client=dutd, dstip=dutc.devip, proto='TCP', interval=1, flowtime=7200, tos="BE", window='4M', retention=600)
+        elephant4 = iperf_flow(name="Elephant4(tcp)", user='root', server=dutd, client=dutc, dstip=dutd.devip, proto='TCP', interval=1, flowtime=7200, tos="BE", window='4M', retention=600)
         elephants.extend([elephant3, elephant4])
 
 # Open ssh node consoles (will setup up ssh master control session as well)
@@ -228,6 +231,8 @@ for i in range(args.runcount) :
     mouse.stats_reset()
 
     iperf_flow.run(amount='256K', time=None, flows=[mouse], preclean=False, parallel=args.parallel, triptime=True)
+    if args.parallel :
+        logging.info('stream fairness={} (txbytes)'.format(mouse.fairness()))
 
     for dut in [dut_observe, ap] :
         dut.wl(cmd='dump ampdu')
@@ -249,6 +254,7 @@ for i in range(args.runcount) :
 if not args.nocompete:
     logging.info('Ceasing elephants')
     iperf_flow.cease(flows=elephants)
+iperf_flow.cease(flows=[mouse])
 ssh_node.close_consoles()
 loop.close()
 
@@ -0,0 +1,555 @@
+#!/usr/bin/env python3.5
+#
+# ---------------------------------------------------------------
+# * Copyright (c) 2018
+# * Broadcom Corporation
+# * All Rights Reserved.
+# *---------------------------------------------------------------
+# Redistribution and use in source and binary forms, with or without modification, are permitted
+# provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this list of conditions
+# and the following disclaimer.  Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the documentation and/or other
+# materials provided with the distribution.  Neither the name of the Broadcom nor the names of
+# contributors may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# Author Robert J. McMahon, Broadcom LTD
+#
+# Unit tests of the flows output parsing and stats, fed canned iperf output so
+# no traffic, ssh or remote hosts are needed.  Run from this directory with
+#   python3 -m unittest test_flows
+# or from the top directory with
+#   python3 -m pytest flows
+#
+# Date October 2026
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+try :
+    # flows.test_flows, e.g. pytest from the top directory where flows is the package
+    from .flows import *
+except ImportError :
+    from flows import *
+
+class loop_kwarg_shim(object) :
+    # flows passes loop= to asyncio, which python 3.10 removed (the running loop
+    # is used).  The tests drop the loop= of those calls rather than skip.
+    classes = ('Event', 'Queue', 'PriorityQueue')
+    coroutines = ('create_subprocess_exec', 'wait', 'wait_for')
+    saved = {}
+
+    @classmethod
+    def needed(cls) :
+        try :
+            asyncio.Event(loop=None)
+        except TypeError :
+            return True
+        return False
+
+    @classmethod
+    def install(cls) :
+        if cls.saved or not cls.needed() :
+            return
+        for name in cls.classes :
+            original = getattr(asyncio, name)
+            def __init__(self, *args, loop=None, _original=original, **kwargs) :
+                _original.__init__(self, *args, **kwargs)
+            cls.saved[name] = original
+            setattr(asyncio, name, type(name, (original,), {'__init__' : __init__}))
+        for name in cls.coroutines :
+            original = getattr(asyncio, name)
+            def stripped(*args, loop=None, _original=original, **kwargs) :
+                return _original(*args, **kwargs)
+            cls.saved[name] = original
+            setattr(asyncio, name, stripped)
+
+    @classmethod
+    def remove(cls) :
+        for name, original in cls.saved.items() :
+            setattr(asyncio, name, original)
+        cls.saved.clear()
+
+def setUpModule() :
+    loop_kwarg_shim.install()
+
+def tearDownModule() :
+    loop_kwarg_shim.remove()
+
+def feed(protocol, text) :
+    protocol.pipe_data_received(1, text.encode())
+
+class line_framer_test(unittest.TestCase) :
+    def test_partial_lines(self) :
+        framer = line_framer()
+        self.assertEqual([bytes(line) for line in framer.feed(b'one\ntw')], [b'one'])
+        self.assertEqual([bytes(line) for line in framer.feed(b'o\nthree')], [b'two'])
+        self.assertEqual(framer.pending, 5)
+
+    def test_flush(self) :
+        framer = line_framer()
+        list(framer.feed(b'one\ntwo'))
+        self.assertEqual([bytes(line) for line in framer.flush()], [b'two'])
+        self.assertEqual(list(framer.flush()), [])
+
+class interval_join_test(unittest.TestCase) :
+    def test_pairs_by_interval(self) :
+        stats = {'flowrate' : None}
+        join = flow_interval_join(stats)
+        # rx runs ahead of tx, each waits for its interval's counterpart
+        self.assertIsNone(join.add('rx', 0, 900))
+        self.assertIsNone(join.add('rx', 1, 500))
+        self.assertEqual(join.add('tx', 1, 1000), (1, 1000, 500, 0.5))
+        self.assertEqual(stats['flowrate'], 0.5)
+        self.assertEqual(join.add('tx', 0, 1000), (0, 1000, 900, 0.9))
+        self.assertEqual(join.paired, 2)
+        self.assertIsNone(join.add('tx', 2, 0))
+        self.assertEqual(join.add('rx', 2, 10)[3], None)
+
+    def test_prune(self) :
+        # the rx pipe closed early, its intervals never come so tx ones stop waiting
+        join = flow_interval_join({'flowrate' : None})
+        for index in range(200) :
+            join.add('tx', index, 1000)
+        join.add('rx', 199, 1000)
+        self.assertIsNone(join.add('rx', 0, 1000))
+        self.assertEqual(join.add('rx', 190, 500)[3], 0.5)
+        self.assertEqual(join.paired, 2)
+
+class ks_binned_test(unittest.TestCase) :
+    def test_matches_scipy(self) :
+        import scipy.stats
+        rng = np.random.default_rng(7)
+        for shift in (0, 3, 20) :
+            x1 = np.arange(100, 200)
+            c1 = rng.integers(0, 50, len(x1))
+            x2 = np.arange(100 + shift, 230 + shift)
+            c2 = rng.integers(0, 50, len(x2))
+            d, p = ks_2samp_binned(x1, c1, x2, c2)
+            result = scipy.stats.ks_2samp(np.repeat(x1, c1), np.repeat(x2, c2), method='asymp')
+            self.assertAlmostEqual(d, result.statistic, places=12)
+            # Stephens' correction of the effective sample size moves p a little
+            self.assertAlmostEqual(p, result.pvalue, delta=0.01)
+
+class histogram_test(unittest.TestCase) :
+    def histogram(self, counts, start=100) :
+        values = ','.join('{}:{}'.format(start + index, count) for index, count in enumerate(counts))
+        return flow_histogram(name='T8', values=values, population=int(sum(counts)), binwidth=10, outliers='0', lci='5', uci='95', lci_val='0', uci_val='0')
+
+    def test_quantile(self) :
+        rng = np.random.default_rng(3)
+        h = self.histogram(rng.integers(0, 40, 200))
+        samples = h.samples * h.binwidth / 1000.0
+        for q in (0.01, 0.25, 0.5, 0.9, 0.99, 1.0) :
+            self.assertAlmostEqual(h.quantile(q), float(np.quantile(samples, q, method='inverted_cdf')))
+        self.assertAlmostEqual(h.cdf(h.quantile(0.5)), float(np.mean(samples <= h.quantile(0.5))))
+
+    def test_merge(self) :
+        rng = np.random.default_rng(5)
+        h1 = self.histogram(rng.integers(0, 40, 100))
+        h2 = self.histogram(rng.integers(0, 40, 150), start=150)
+        merged = flow_histogram.merge([h1, h2])
+        self.assertEqual(merged.population, h1.population + h2.population)
+        samples = np.sort(np.concatenate([h1.samples, h2.samples]))
+        self.assertTrue(np.array_equal(merged.samples, samples))
+        self.assertAlmostEqual(merged.quantile(0.95), float(np.quantile(samples * 10 / 1000.0, 0.95, method='inverted_cdf')))
+        with self.assertRaises(ValueError) :
+            flow_histogram.merge([h1, flow_histogram(name='T8', values='1:1', population=1, binwidth=20)])
+
+class ring_columns_test(unittest.TestCase) :
+    def test_aggregates(self) :
+        # the ring keeps the last capacity samples, the aggregates cover every one
+        rng = np.random.default_rng(11)
+        values = rng.normal(1000, 50, 100)
+        ring = flow_ring_columns({}, [('x', 'd')], capacity=16)
+        for value in values[:40] :
+            ring.append(value)
+        ring.extend(values[40:])
+        self.assertTrue(np.array_equal(ring.view('x'), values[-16:]))
+        aggregates = ring.aggregates['x']
+        self.assertEqual(aggregates.count, 100)
+        self.assertAlmostEqual(aggregates.mean, values.mean())
+        self.assertAlmostEqual(aggregates.variance, values.var(ddof=1))
+        self.assertEqual((aggregates.min, aggregates.max), (values.min(), values.max()))
+
+class pipe_close_test(unittest.TestCase) :
+    def test_last_line_without_newline(self) :
+        flow = iperf_flow(name='flush', interval=0.5)
+        flow.destroy()
+        protocol = flow.tx.IperfClientProtocol(flow.tx, flow)
+        feed(protocol, 'Client connecting to 127.0.0.1, TCP port {} with pid 1\n'.format(flow.dstport))
+        feed(protocol, '[  3] 0.00-0.50 sec  655620 Bytes  10489920 bits/sec  14/211        446      446K/0 us')
+        self.assertEqual(len(flow.txsamples), 0)
+        protocol.pipe_connection_lost(1, None)
+        self.assertEqual(list(flow.txbytes), [655620])
+
+class summary_test(unittest.TestCase) :
+    # -i 1, the final report from 0 comes after the first interval report from 0
+    reports = [('0.00-1.00', 200000), ('0.00-1.20', 262144), ('0.00-1.00', 1000), ('1.00-2.00', 1000), ('0.00-2.00', 2000)]
+
+    def flow(self) :
+        flow = iperf_flow(name='summary', interval=1)
+        flow.destroy()
+        return flow
+
+    def test_final_report(self) :
+        flow = self.flow()
+        client = flow.tx.IperfClientProtocol(flow.tx, flow)
+        feed(client, 'Client connecting to 192.168.1.1, TCP port {} with pid 2\n'.format(flow.dstport))
+        for interval, count in self.reports[:2] :
+            feed(client, '[  3] {} sec  {} Bytes  1600000 bits/sec  10/0        0      10K/5 us\n'.format(interval, count))
+        self.assertEqual(list(flow.txbytes), [200000])
+        self.assertEqual(flow.txsummary['txbytes'], 262144)
+
+    def test_add_samples(self) :
+        # the next run's first report is a sample again, same as one sample at a time
+        flow, expected = self.flow(), self.flow()
+        start, end = zip(*[iperf_line_classifier.interval(interval.encode()) for interval, _ in self.reports])
+        counts = [count for _, count in self.reports]
+        flow.add_samples('rx', np.array(start), np.array(end), np.array(counts), np.array(counts) * 8, np.ones(len(counts), dtype=np.int64))
+        for (interval, count) in self.reports :
+            expected.add_sample('rx', interval.encode(), count, count * 8, 1)
+        self.assertEqual(list(flow.rxbytes), [200000, 1000, 1000])
+        self.assertEqual(list(flow.rxbytes), list(expected.rxbytes))
+        self.assertEqual(flow.rxsummary, expected.rxsummary)
+
+class parallel_test(unittest.TestCase) :
+    # -P 4, each side keeps per stream records, the flow's series are the sums
+    def test_server_streams(self) :
+        flow = iperf_flow(name='parallel', interval=1)
+        flow.destroy()
+        flow.tx.parallel = flow.rx.parallel = 4
+        client = flow.tx.IperfClientProtocol(flow.tx, flow)
+        server = flow.rx.IperfServerProtocol(flow.rx, flow)
+        feed(server, 'Server listening on TCP port {} with pid 1\n'.format(flow.dstport))
+        feed(client, 'Client connecting to 192.168.1.1, TCP port {} with pid 2\n'.format(flow.dstport))
+        for interval in ('0.00-1.00', '1.00-2.00', '0.00-2.00') :
+            for stream in range(4) :
+                feed(client, '[  {}] {} sec  100000 Bytes  800000 bits/sec  10/0        0      10K/5 us\n'.format(3 + stream, interval))
+                feed(server, '[  {}] {} sec  100000 Bytes  800000 bits/sec  10    10:0:0:0:0:0:0:0\n'.format(4 + stream, interval))
+            feed(client, '[SUM] {} sec  400000 Bytes  3200000 bits/sec  40/0        0\n'.format(interval))
+        self.assertEqual(sorted(flow.flowstats['rxstreams']), [4, 5, 6, 7])
+        self.assertEqual(list(flow.rxbytes), [400000, 400000])
+        self.assertEqual(list(flow.txbytes), [400000, 400000])
+        self.assertEqual(flow.rxsummary['rxbytes'], 400000)
+        self.assertEqual(flow.flowrate, 1.0)
+        self.assertEqual(flow.fairness('rxbytes'), 1.0)
+
+    def test_stream_ends_early(self) :
+        # -P 2 -i 1, stream 4 is done before the first interval, stream 5 just after
+        flow = iperf_flow(name='parallel', interval=1)
+        flow.destroy()
+        flow.rx.parallel = 2
+        server = flow.rx.IperfServerProtocol(flow.rx, flow)
+        feed(server, 'Server listening on TCP port {} with pid 1\n'.format(flow.dstport))
+        for stream, interval, count in ((5, '0.00-1.00', 200000), (4, '0.00-0.80', 262144), (5, '0.00-1.20', 240000)) :
+            feed(server, '[  {}] {} sec  {} Bytes  800000 bits/sec  10    10:0:0:0:0:0:0:0\n'.format(stream, interval, count))
+        self.assertEqual(list(flow.rxbytes), [200000])
+        self.assertEqual((flow.rxsummary['rxbytes'], flow.rxsummary['end']), (502144, 1.2))
+        self.assertEqual(flow.flowstats['rxsums'], {})
+
+    def test_flush_stream_sums(self) :
+        # a run stopped short, the interval only one stream reported is recorded at the end
+        flow = iperf_flow(name='parallel', interval=1)
+        flow.destroy()
+        flow.rx.parallel = 2
+        for stream, interval in ((4, '0.00-1.00'), (5, '0.00-1.00'), (4, '1.00-2.00'), (4, '1.00-2.00')) :
+            flow.add_stream_sample('rx', stream, interval.encode(), 1000, 8000, 1)
+        self.assertEqual(list(flow.rxbytes), [2000])
+        flow.flush_stream_sums()
+        self.assertEqual(list(flow.rxbytes), [2000, 1000])
+        self.assertEqual(flow.flowstats['rxsums'], {})
+
+class persistent_server_test(unittest.TestCase) :
+    # runs on a persistent server are told apart by their transfers, whose ids (fds) get reused
+    def setUp(self) :
+        self.flow = iperf_flow(name='persistent', interval=1, persistent=True)
+        self.flow.destroy()
+        self.protocol = self.flow.rx.IperfServerProtocol(self.flow.rx, self.flow)
+        feed(self.protocol, 'Server listening on TCP port {} with pid 1\n'.format(self.flow.dstport))
+
+    def run_transfer(self, reports, port=56949) :
+        self.flow.rx.expect_transfers(1)
+        feed(self.protocol, '[  4] local 192.168.1.1 port {} connected with 192.168.1.4 port {}\n'.format(self.flow.dstport, port))
+        for report in reports :
+            feed(self.protocol, '[  4] {} sec  262144 Bytes  69905066 bits/sec  4    4:0:0:0:0:0:0:0\n'.format(report))
+
+    def test_reused_transferid(self) :
+        self.run_transfer(['0.00-1.00', '1.00-2.00', '0.00-2.00'])
+        self.assertTrue(self.flow.rx.transfer_done.is_set())
+        self.run_transfer(['0.00-1.00', '1.00-2.00', '0.00-2.00'], port=56950)
+        self.assertTrue(self.flow.rx.transfer_done.is_set())
+        self.assertEqual(len(self.flow.rxsamples), 4)
+
+    def test_short_transfer(self) :
+        # a mouse shorter than the interval only has its final report
+        for port in (56949, 56950) :
+            self.run_transfer(['0.00-0.03'], port=port)
+            self.assertTrue(self.flow.rx.transfer_done.is_set())
+
+    def test_interval_long_transfer(self) :
+        # the first interval report starts at 0 too but doesn't end the transfer
+        self.run_transfer(['0.00-1.00'])
+        self.assertFalse(self.flow.rx.transfer_done.is_set())
+        feed(self.protocol, '[  4] 0.00-1.00 sec  262144 Bytes  2097152 bits/sec  4    4:0:0:0:0:0:0:0\n')
+        self.assertTrue(self.flow.rx.transfer_done.is_set())
+
+    def test_trip_time(self) :
+        self.run_transfer(['0.00-1.00'])
+        feed(self.protocol, '[  4] 0.0000-1.0040 trip-time (3WHS done->fin+finack) = 1.0052 sec\n')
+        self.assertTrue(self.flow.rx.transfer_done.is_set())
+
+class server_mux_test(unittest.TestCase) :
+    # a long lived shared server sees transfer ids (fds) reused across runs
+    def setUp(self) :
+        self.flow = iperf_flow(name='shared', server='mux-test', interval=1, shared_server=True)
+        self.flow.destroy()
+        self.mux = self.flow.rx.mux
+        # as attach() does when it starts the listener
+        self.mux.configure()
+
+    def tearDown(self) :
+        iperf_server_mux.instances.pop(('mux-test', 'TCP'), None)
+
+    def line(self, text) :
+        kind, m = iperf_server_classifier.classify(text.encode())
+        self.mux.report_received(kind, m)
+
+    def test_reused_transferid(self) :
+        for port in (56949, 56950) :
+            self.flow.rx.expect_transfers(1)
+            self.line('[  4] local 192.168.1.1 port {} connected with 192.168.1.4 port {}'.format(self.mux.dstport, port))
+            self.mux.claim(self.flow.rx, b'192.168.1.4', str(port).encode())
+            self.line('[  4] 0.00-0.03 sec  262144 Bytes  69905066 bits/sec  4    4:0:0:0:0:0:0:0')
+            self.assertTrue(self.flow.rx.transfer_done.is_set())
+            # shorter than the interval, the only report is the final one
+            self.assertEqual(self.flow.rxsummary['end'], 0.03)
+            self.flow.flowstats['rxsummary'] = None
+        self.assertEqual(len(self.flow.rxsamples), 0)
+
+    def test_register_resets(self) :
+        self.flow.rx.expect_transfers(1)
+        self.line('[  4] local 192.168.1.1 port {} connected with 192.168.1.4 port 56949'.format(self.mux.dstport))
+        self.mux.claim(self.flow.rx, b'192.168.1.4', b'56949')
+        self.mux.register(self.flow)
+        self.assertEqual(self.flow.rx.transfers, {})
+        self.assertEqual(self.mux.peers, {})
+        self.assertEqual(self.mux.flows, [self.flow])
+
+class replay_test(unittest.TestCase) :
+    # a log with a summary and a second run, the bulk traffic parsing must match line_received()
+    log = ['Server listening on TCP port 61002 with pid 2566',
+           'Client connecting to 192.168.1.1, TCP port 61002 with pid 1904',
+           '[  3] 0.00-0.50 sec  655620 Bytes  10489920 bits/sec  14/211        446      446K/0 us',
+           '[  4] 0.00-0.50 sec  655000 Bytes  10480000 bits/sec  449    449:0:0:0:0:0:0:0',
+           '[  3] 0.50-1.00 sec  655000 Bytes  10480000 bits/sec  14/211        446      446K/0 us',
+           '[  4] 0.50-1.00 sec  654000 Bytes  10464000 bits/sec  449    449:0:0:0:0:0:0:0',
+           '[  3] 0.00-1.00 sec  1310620 Bytes  10484960 bits/sec  28/422        892      446K/0 us',
+           'Client connecting to 192.168.1.1, TCP port 61002 with pid 1905',
+           '[  3] 0.00-0.50 sec  1000 Bytes  16000 bits/sec  1/0        0      10K/5 us']
+    sides = ['RX', 'TX', 'TX', 'RX', 'TX', 'RX', 'TX', 'TX', 'TX']
+
+    def replay(self, filename, reset_on_open) :
+        with open(filename, 'w') as fid :
+            for side, line in zip(self.sides, self.log) :
+                fid.write('2018-10-30 10:01:02,123 INFO     flows      [Mouse(tcp)->{}(10.0.0.1)] {} (stdout,1904)\n'.format(side, line))
+        bulk = flow_replay(interval=0.5, reset_on_open=reset_on_open).load_log(filename)['Mouse(tcp)']
+        lines = flow_replay(interval=0.5, reset_on_open=reset_on_open)
+        for side, line in zip(self.sides, self.log) :
+            lines.line_received('Mouse(tcp)', side, line.encode())
+        return bulk, lines.flows['Mouse(tcp)']
+
+    def test_bulk_matches_lines(self) :
+        with tempfile.TemporaryDirectory() as directory :
+            for reset_on_open in (False, True) :
+                bulk, lines = self.replay(os.path.join(directory, 'test.log'), reset_on_open)
+                for name in ('txstart', 'txbytes', 'rtt', 'rxend', 'rxbytes', 'reads') :
+                    self.assertEqual(list(bulk.flowstats[name]), list(lines.flowstats[name]))
+                self.assertEqual(bulk.flowstats['txsummary'], lines.flowstats['txsummary'])
+                self.assertEqual(bulk.flowstats['join'].last, lines.flowstats['join'].last)
+                self.assertEqual(bulk.flowstats['flowrate'], lines.flowstats['flowrate'])
+        self.assertEqual(list(bulk.txbytes), [1000])
+
+    def test_parallel(self) :
+        # -P 2 is told from the client's connections, the streams aren't the flow's series
+        log = [('RX', 'Server listening on TCP port 61002 with pid 2566'),
+               ('TX', 'Client connecting to 192.168.1.1, TCP port 61002 with pid 1904'),
+               ('TX', '[  3] local 192.168.1.4 port 56949 connected with 192.168.1.1 port 61002 (ct=1.37 ms)'),
+               ('TX', '[  4] local 192.168.1.4 port 56950 connected with 192.168.1.1 port 61002 (ct=1.37 ms)')]
+        for interval in ('0.00-0.50', '0.50-1.00', '0.00-1.00') :
+            for stream in (3, 4) :
+                log.append(('TX', '[  {}] {} sec  1000 Bytes  16000 bits/sec  1/0        0      10K/5 us'.format(stream, interval)))
+                log.append(('RX', '[  {}] {} sec  900 Bytes  14400 bits/sec  1    1:0:0:0:0:0:0:0'.format(stream + 2, interval)))
+            log.append(('TX', '[SUM] {} sec  2000 Bytes  32000 bits/sec  2/0        0'.format(interval)))
+        with tempfile.TemporaryDirectory() as directory :
+            filename = os.path.join(directory, 'test.log')
+            with open(filename, 'w') as fid :
+                for side, line in log :
+                    fid.write('2018-10-30 10:01:02,123 INFO     flows      [Mouse(tcp)->{}(10.0.0.1)] {} (stdout,1904)\n'.format(side, line))
+            flow = flow_replay(interval=0.5).load_log(filename)['Mouse(tcp)']
+        self.assertEqual((flow.tx.parallel, flow.rx.parallel), (2, 2))
+        self.assertEqual(list(flow.txbytes), [2000, 2000])
+        self.assertEqual(list(flow.rxbytes), [1800, 1800])
+        self.assertEqual(flow.txsummary['txbytes'], 2000)
+        self.assertEqual(flow.rxsummary['rxbytes'], 1800)
+        self.assertEqual(sorted(flow.flowstats['streams']), [3, 4])
+        self.assertEqual(list(flow.stream(3)['txsamples'].view('txbytes')), [1000, 1000])
+        self.assertTrue(all(stream['flowid'] is not None for stream in flow.flowstats['streams'].values()))
+
+class ks_table_test(unittest.TestCase) :
+    def histogram(self, shift) :
+        values = ','.join('{}:{}'.format(value, 10 + (value + shift) % 7) for value in range(100, 200))
+        return flow_histogram(name='T8', values=values, population=100, binwidth=10, outliers='0', lci='5', uci='95', lci_val='1', uci_val='2')
+
+    def test_add_later(self) :
+        # rows are computed off the loop but added in arrival order, same as add()
+        loop = asyncio.new_event_loop()
+        histograms = [self.histogram(shift) for shift in range(4)]
+        table, expected = ks_table('T8'), ks_table('T8')
+        for histogram in histograms :
+            expected.add(histogram)
+        async def add() :
+            for histogram in histograms :
+                table.add_later(histogram, loop)
+            self.assertEqual(len(table), 0)
+            await table._adding
+        try :
+            loop.run_until_complete(add())
+        finally :
+            loop.close()
+        self.assertEqual([h.uid for h in table.histograms], [h.uid for h in histograms])
+        self.assertTrue(np.array_equal(table.pmatrix, expected.pmatrix))
+
+    def test_update_while_adding(self) :
+        # an update() with the row while add_later() computes its pairs mustn't
+        # leave the row in the table twice
+        import threading
+        loop = asyncio.new_event_loop()
+        histograms = [self.histogram(shift) for shift in range(3)]
+        table = ks_table('T8')
+        table.add(histograms[0])
+        started, release = threading.Event(), threading.Event()
+        compute = ks_table.compute
+        saved = ks_table.__dict__['compute']
+        def slow_compute(grids, pairs) :
+            if threading.current_thread() is not threading.main_thread() :
+                started.set()
+                release.wait(5)
+            return compute(grids, pairs)
+        async def add() :
+            adding = table.add_later(histograms[1], loop)
+            await loop.run_in_executor(None, started.wait, 5)
+            table.update(histograms)
+            release.set()
+            await adding
+        ks_table.compute = staticmethod(slow_compute)
+        try :
+            loop.run_until_complete(add())
+        finally :
+            ks_table.compute = saved
+            loop.close()
+        self.assertEqual([h.uid for h in table.histograms], [h.uid for h in histograms])
+        self.assertEqual(table.pmatrix.shape, (3, 3))
+
+    def test_pool_main_thread(self) :
+        # the process pool isn't forked from an executor thread, its pairs are computed there
+        import concurrent.futures
+        saved, ks_table._pool = ks_table._pool, None
+        executor = concurrent.futures.ThreadPoolExecutor(1)
+        try :
+            self.assertIsNone(executor.submit(ks_table.pool).result())
+            grids = [self.histogram(shift).grid for shift in range(4)]
+            pairs = [(i, j) for j in range(4) for i in range(j)] * (ks_table.chunk_pairs // 6 + 1)
+            self.assertEqual(executor.submit(ks_table.compute, grids, pairs).result(), ks_pairs(grids, pairs))
+            self.assertIsNone(ks_table._pool)
+        finally :
+            executor.shutdown()
+            ks_table._pool = saved
+
+class lag_monitor_test(unittest.TestCase) :
+    def test_shared(self) :
+        # two runs overlap, the monitor measures until the later one stops
+        loop = asyncio.new_event_loop()
+        monitor = loop_lag_monitor(interval=0.01, loop=loop)
+        async def run(duration) :
+            monitor.start()
+            try :
+                await asyncio.sleep(duration)
+            finally :
+                monitor.stop()
+        async def runs() :
+            later = asyncio.ensure_future(run(0.2))
+            await run(0.05)
+            self.assertIsNotNone(monitor._task)
+            samples = monitor.lag.count
+            await later
+            self.assertIsNone(monitor._task)
+            self.assertGreater(monitor.lag.count, samples)
+        try :
+            loop.run_until_complete(runs())
+        finally :
+            loop.close()
+
+class gnuplot_pool_test(unittest.TestCase) :
+    def setUp(self) :
+        self.directory = tempfile.TemporaryDirectory()
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self) :
+        self.loop.close()
+        self.directory.cleanup()
+
+    def pool(self, script) :
+        # a gnuplot stand in running script
+        gnuplot = os.path.join(self.directory.name, 'gnuplot')
+        with open(gnuplot, 'w') as fid :
+            fid.write('#!{}\nimport sys, time\n{}'.format(sys.executable, script))
+        os.chmod(gnuplot, 0o755)
+        return gnuplot_pool(size=1, gnuplot=gnuplot, timeout=0.5, loop=self.loop)
+
+    def test_hung_render(self) :
+        # a gnuplot that never prints the sentinel fails the render rather than the worker
+        pool = self.pool('sys.stdin.readline()\ntime.sleep(60)\n')
+        with self.assertRaises(asyncio.TimeoutError) :
+            self.loop.run_until_complete(pool.render('hung.gpc'))
+        self.assertEqual(pool._processes, [])
+        self.assertEqual(pool.errors, 1)
+        self.loop.run_until_complete(pool.close())
+
+    def test_exited(self) :
+        # a gnuplot that exits mid render isn't kept as one of the pool's
+        pool = self.pool('sys.stdin.readline()\n')
+        with self.assertRaises(EOFError) :
+            self.loop.run_until_complete(pool.render('exit.gpc'))
+        self.assertEqual(pool._processes, [])
+        self.loop.run_until_complete(pool.close())
+
+    def test_close_hung(self) :
+        # a gnuplot that renders but ignores exit is killed by close()
+        pool = self.pool('for line in sys.stdin :\n    if line.startswith("print") :\n        print("{}", flush=True)\n    elif line.startswith("exit") :\n        time.sleep(60)\n'.format(gnuplot_pool.sentinel))
+        self.assertEqual(self.loop.run_until_complete(pool.render('ok.gpc')), '')
+        process = pool._processes[0]
+        timer = time.perf_counter()
+        self.loop.run_until_complete(pool.close())
+        self.assertLess(time.perf_counter() - timer, 5)
+        self.assertIsNotNone(process.returncode)
+        self.assertEqual(pool._processes, [])
+
+if __name__ == '__main__' :
+    unittest.main()